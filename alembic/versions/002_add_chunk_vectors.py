@@ -0,0 +1,35 @@
+"""add chunk vectors
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Embeddings of the sqlite vector store backend; the app may already have created the table
+    if sa.inspect(op.get_bind()).has_table('chunk_vectors'):
+        return
+    op.create_table(
+        'chunk_vectors',
+        sa.Column('chunk_id', sa.String(36), sa.ForeignKey('document_chunks.id'), primary_key=True),
+        sa.Column('document_id', sa.String(36), sa.ForeignKey('documents.id'), nullable=False),
+        sa.Column('course_id', sa.String(36), sa.ForeignKey('courses.id'), nullable=False),
+        sa.Column('vector', sa.LargeBinary(), nullable=False),
+        sa.Column('dimension', sa.Integer(), nullable=False),
+        sa.Column('content_key', sa.String(64)),
+        sa.Column('created_at', sa.DateTime()),
+    )
+    op.create_index('ix_chunk_vectors_document_id', 'chunk_vectors', ['document_id'])
+    op.create_index('ix_chunk_vectors_course_id', 'chunk_vectors', ['course_id'])
+    op.create_index('ix_chunk_vectors_content_key', 'chunk_vectors', ['content_key'])
+
+def downgrade():
+    op.drop_table('chunk_vectors')
@@ -4,10 +4,12 @@ Script to check if embeddings are being stored properly.
 """
 
 import os
-import json
 import argparse
+from datetime import datetime
 from pathlib import Path
 
+from services.segment_log import SegmentLog
+
 def check_embeddings_directory(base_dir=None):
     """Check the embeddings directory structure and contents."""
     if base_dir is None:
@@ -38,9 +40,9 @@ def check_embeddings_directory(base_dir=None):
           f"Write: {'✅' if writable else '❌'}, "
           f"Execute: {'✅' if executable else '❌'}")
     
-    # List course directories
+    # List course directories; dot directories hold shared content or deletions in progress
     course_dirs = [d for d in os.listdir(embeddings_dir) 
-                   if os.path.isdir(os.path.join(embeddings_dir, d))]
+                   if not d.startswith('.') and os.path.isdir(os.path.join(embeddings_dir, d))]
     
     if not course_dirs:
         print("❌ No course directories found.")
@@ -48,58 +50,44 @@ def check_embeddings_directory(base_dir=None):
     
     print(f"✅ Found {len(course_dirs)} course directories: {', '.join(course_dirs)}")
     
-    # Check each course directory
+    # Check each course directory using the statistics kept in its segment manifest
     total_docs = 0
     total_vectors = 0
+    total_bytes = 0
     
     for course_id in course_dirs:
         course_dir = os.path.join(embeddings_dir, course_id)
-        doc_files = [f for f in os.listdir(course_dir) 
-                     if f.endswith('.json') and os.path.isfile(os.path.join(course_dir, f))]
+        try:
+            stats = SegmentLog(course_dir).stats(persist=False)
+        except Exception as e:
+            print(f"❌ Error reading segment manifest in course {course_id}: {str(e)}")
+            continue
         
-        if not doc_files:
-            print(f"❌ No document files found in course: {course_id}")
+        if not stats["documents"]:
+            print(f"❌ No documents found in course: {course_id}")
             continue
         
-        print(f"✅ Course {course_id}: Found {len(doc_files)} document files")
-        total_docs += len(doc_files)
+        print(f"✅ Course {course_id}: {stats['documents']} documents, {stats['vectors']} vectors "
+              f"in {stats['segments']} segments, {stats['bytes']} bytes")
         
-        # Check one document file as a sample
-        sample_file = os.path.join(course_dir, doc_files[0])
-        try:
-            with open(sample_file, 'r') as f:
-                vectors = json.load(f)
-                
-            if not vectors:
-                print(f"❌ Empty vectors file: {sample_file}")
-                continue
-                
-            print(f"✅ Sample file {doc_files[0]}: Contains {len(vectors)} vectors")
-            
-            # Verify vector structure
-            sample_vector = vectors[0]
-            if 'id' in sample_vector and 'vector' in sample_vector and 'payload' in sample_vector:
-                print(f"✅ Vector structure looks good")
-                vector_dim = len(sample_vector['vector'])
-                print(f"✅ Vector dimension: {vector_dim}")
-            else:
-                print(f"❌ Invalid vector structure: {list(sample_vector.keys())}")
-                
-            # Count total vectors
-            for doc_file in doc_files:
-                file_path = os.path.join(course_dir, doc_file)
-                with open(file_path, 'r') as f:
-                    file_vectors = json.load(f)
-                    total_vectors += len(file_vectors)
-                    
-        except Exception as e:
-            print(f"❌ Error reading vector file {sample_file}: {str(e)}")
+        if len(stats["dimensions"]) == 1:
+            print(f"✅ Vector dimension: {stats['dimensions'][0]}")
+        else:
+            print(f"❌ Mixed vector dimensions: {stats['dimensions']}")
+        
+        if stats["last_modified"]:
+            print(f"   Last modified: {datetime.fromtimestamp(stats['last_modified']).isoformat()}")
+        
+        total_docs += stats["documents"]
+        total_vectors += stats["vectors"]
+        total_bytes += stats["bytes"]
     
     # Summary
     print("\n=== Summary ===")
     print(f"Total courses: {len(course_dirs)}")
-    print(f"Total document files: {total_docs}")
+    print(f"Total documents: {total_docs}")
     print(f"Total vector embeddings: {total_vectors}")
+    print(f"Total bytes on disk: {total_bytes}")
     
     if total_vectors > 0:
         print("\n✅ SUCCESS: Embeddings are being stored correctly!")
@@ -1,8 +1,10 @@
 from fastapi import FastAPI, WebSocket, UploadFile, File, Form, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 import asyncio
 from typing import List
+from datetime import datetime
 import json
 import os
 from dotenv import load_dotenv
@@ -11,7 +13,8 @@ from services.embedding import EmbeddingService
 from services.ingestion import IngestionService
 from services.query import QueryService
 from routers import courses, chat, sync
-from models.database import engine, Base
+from models.database import engine, Base, AsyncSessionLocal, Course, ChatMessage
+from sqlalchemy import select, func
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +24,45 @@ embedding_service = EmbeddingService()
 ingestion_service = IngestionService()
 query_service = QueryService()
 
+# Readiness, separate from liveness: traffic should only be routed once warm-up is done
+readiness = {"ready": False, "warm_up": None}
+
+async def rank_active_courses(limit: int) -> List[str]:
+    """Course ids ordered by most recent activity: the later of the last sync and the last chat message"""
+    async with AsyncSessionLocal() as session:
+        last_message = (
+            select(ChatMessage.course_id, func.max(ChatMessage.created_at).label("last_message"))
+            .group_by(ChatMessage.course_id)
+            .subquery()
+        )
+        result = await session.execute(
+            select(Course.id, Course.last_sync, last_message.c.last_message)
+            .outerjoin(last_message, last_message.c.course_id == Course.id)
+            .where(Course.is_active == True)
+        )
+        rows = result.all()
+    
+    def last_active(row):
+        times = [t for t in (row.last_sync, row.last_message) if t is not None]
+        return max(times) if times else datetime.min
+    
+    return [row.id for row in sorted(rows, key=last_active, reverse=True)[:limit]]
+
+async def warm_up():
+    """Preload the indexes of the most active courses, then report ready"""
+    try:
+        course_limit = int(os.getenv("WARMUP_COURSES", "20"))
+        memory_budget = int(float(os.getenv("WARMUP_MEMORY_MB", "512")) * 1024 * 1024)
+        if course_limit > 0 and memory_budget > 0:
+            course_ids = await rank_active_courses(course_limit)
+            readiness["warm_up"] = await embedding_service.warm_up(course_ids, memory_budget)
+            print(f"Warmed up {len(readiness['warm_up']['loaded'])} courses")
+    except Exception as e:
+        # A failed warm-up only costs latency; searches load courses on demand
+        print(f"Warm-up error: {e}")
+        readiness["warm_up"] = {"error": str(e)}
+    readiness["ready"] = True
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
@@ -37,10 +79,14 @@ async def lifespan(app: FastAPI):
     
     print("Services initialized successfully!")
     
+    # Warm up in the background so liveness checks pass while indexes load
+    warm_up_task = asyncio.create_task(warm_up())
+    
     yield
     
     # Shutdown
     print("Shutting down...")
+    warm_up_task.cancel()
     await embedding_service.cleanup()
 
 app = FastAPI(
@@ -145,4 +191,16 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Ready once startup warm-up has finished; 503 until then"""
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready", "warm_up": readiness["warm_up"]}
+
+@app.get("/api/embeddings/stats")
+async def embeddings_stats():
+    """Vector counts, dimensions and disk usage for every course, without scanning vector files"""
+    return await embedding_service.get_collection_info()
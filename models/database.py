@@ -1,7 +1,7 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Float
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Float, LargeBinary
 import uuid
 from datetime import datetime
 import os
@@ -96,6 +96,23 @@ class DocumentChunk(Base):
     
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class ChunkVector(Base):
+    __tablename__ = "chunk_vectors"
+    
+    # One embedding per chunk; the chunk text stays in document_chunks only
+    chunk_id = Column(String(36), ForeignKey("document_chunks.id"), primary_key=True)
+    document_id = Column(String(36), ForeignKey("documents.id"), nullable=False, index=True)
+    course_id = Column(String(36), ForeignKey("courses.id"), nullable=False, index=True)
+    
+    # Raw float32 bytes, dimension * 4 long
+    vector = Column(LargeBinary, nullable=False)
+    dimension = Column(Integer, nullable=False)
+    
+    # Hash of embedding model and chunk text, for reusing embeddings of identical chunks
+    content_key = Column(String(64), index=True)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
     
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from typing import List, Dict, Optional
@@ -10,6 +10,8 @@ import logging
 from models.database import get_db, Course, ChatSession, ChatMessage
 from services.query import QueryService
 from services.embedding import EmbeddingService
+from services.vector_filters import FILTER_FIELDS
+from services.file_vector_store import SEARCH_MODES
 import sys
 
 router = APIRouter()
@@ -31,6 +33,36 @@ class ChatResponse(BaseModel):
     confidence: float
     timestamp: str
 
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    limit: int = 10
+    threshold: float = 0.6
+    mode: Optional[str] = None
+    nprobe: Optional[int] = None
+    filters: Optional[Dict[str, List[str]]] = None
+
+class MultiCourseSearchRequest(BaseModel):
+    query: str
+    course_ids: List[str]
+    limit: int = 10
+    threshold: float = 0.6
+    mode: Optional[str] = None
+    nprobe: Optional[int] = None
+    filters: Optional[Dict[str, List[str]]] = None
+
+def validate_search_options(mode: Optional[str], nprobe: Optional[int]):
+    """Reject a search mode or probe count the vector store would not understand"""
+    if mode is not None and mode not in SEARCH_MODES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"mode must be one of {', '.join(SEARCH_MODES)}"
+        )
+    if nprobe is not None and nprobe < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="nprobe must be at least 1"
+        )
+
 class MessageResponse(BaseModel):
     id: str
     content: str
@@ -491,10 +523,18 @@ async def search_course_content(
     q: str,
     limit: int = 10,
     threshold: float = 0.6,
+    mode: Optional[str] = None,
+    nprobe: Optional[int] = None,
+    document_id: Optional[List[str]] = Query(None),
+    chunk_type: Optional[List[str]] = Query(None),
+    filename: Optional[List[str]] = Query(None),
+    retrieval: str = "vector",
     db: AsyncSession = Depends(get_db)
 ):
-    """Search course content using semantic similarity"""
+    """Search course content by semantic similarity, BM25 (lexical) or both fused (hybrid)"""
     try:
+        validate_search_options(mode, nprobe)
+        
         # Verify course exists
         course_result = await db.execute(
             select(Course).where(Course.id == course_id, Course.is_active == True)
@@ -506,13 +546,40 @@ async def search_course_content(
                 detail="Course not found"
             )
         
+        # Repeated query parameters are alternatives; different parameters must all match
+        filters = {
+            field: values
+            for field, values in (("document_id", document_id), ("chunk_type", chunk_type), ("filename", filename))
+            if values
+        }
+        
         # Search using embedding service
-        results = await query_service.embedding_service.search_similar(
-            query=q,
-            course_id=course_id,
-            limit=limit,
-            score_threshold=threshold
-        )
+        if retrieval == "lexical":
+            results = await query_service.embedding_service.search_lexical(
+                query=q,
+                course_id=course_id,
+                limit=limit,
+                filters=filters or None
+            )
+        elif retrieval in ("vector", "hybrid"):
+            search = (
+                query_service.embedding_service.search_hybrid if retrieval == "hybrid"
+                else query_service.embedding_service.search_similar
+            )
+            results = await search(
+                query=q,
+                course_id=course_id,
+                limit=limit,
+                score_threshold=threshold,
+                search_mode=mode,
+                nprobe=nprobe,
+                filters=filters or None
+            )
+        else:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="retrieval must be one of vector, lexical, hybrid"
+            )
         
         return {
             "query": q,
@@ -526,4 +593,129 @@ async def search_course_content(
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Search failed: {str(e)}"
-        ) 
\ No newline at end of file
+        ) 
+
+@router.get("/{course_id}/stats")
+async def get_course_vector_stats(course_id: str):
+    """Vector counts, dimensions, disk usage and last-modified times for a course and its documents"""
+    stats = await query_service.embedding_service.get_course_stats(course_id)
+    if stats is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No vectors stored for this course"
+        )
+    return stats
+
+@router.post("/{course_id}/search/batch")
+async def search_course_content_batch(
+    course_id: str,
+    request: BatchSearchRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """Search course content for several queries in one pass"""
+    try:
+        unknown = set(request.filters or {}) - set(FILTER_FIELDS)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown filter fields: {', '.join(sorted(unknown))}"
+            )
+        validate_search_options(request.mode, request.nprobe)
+        
+        # Verify course exists
+        course_result = await db.execute(
+            select(Course).where(Course.id == course_id, Course.is_active == True)
+        )
+        
+        if not course_result.scalar_one_or_none():
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Course not found"
+            )
+        
+        # Search all queries using embedding service
+        results = await query_service.embedding_service.search_similar_many(
+            queries=request.queries,
+            course_id=course_id,
+            limit=request.limit,
+            score_threshold=request.threshold,
+            search_mode=request.mode,
+            nprobe=request.nprobe,
+            filters=request.filters
+        )
+        
+        return {
+            "results": [
+                {
+                    "query": query,
+                    "results": query_results,
+                    "total_found": len(query_results)
+                }
+                for query, query_results in zip(request.queries, results)
+            ]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Batch search failed: {str(e)}"
+        )
+
+@router.post("/search/courses")
+async def search_multiple_courses(
+    request: MultiCourseSearchRequest,
+    db: AsyncSession = Depends(get_db)
+):
+    """Search the content of several courses at once, merged into one ranked list"""
+    try:
+        unknown = set(request.filters or {}) - set(FILTER_FIELDS)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown filter fields: {', '.join(sorted(unknown))}"
+            )
+        validate_search_options(request.mode, request.nprobe)
+        if not request.course_ids:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="course_ids must not be empty"
+            )
+        
+        # Verify every course exists
+        course_result = await db.execute(
+            select(Course.id).where(Course.id.in_(request.course_ids), Course.is_active == True)
+        )
+        missing = set(request.course_ids) - set(course_result.scalars().all())
+        if missing:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Courses not found: {', '.join(sorted(missing))}"
+            )
+        
+        # Search the courses that can contribute and merge their results
+        results = await query_service.embedding_service.search_courses(
+            query=request.query,
+            course_ids=request.course_ids,
+            limit=request.limit,
+            score_threshold=request.threshold,
+            search_mode=request.mode,
+            nprobe=request.nprobe,
+            filters=request.filters
+        )
+        
+        return {
+            "query": request.query,
+            "course_ids": request.course_ids,
+            "results": results,
+            "total_found": len(results)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Multi-course search failed: {str(e)}"
+        )
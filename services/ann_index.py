@@ -0,0 +1,206 @@
+import os
+import logging
+import itertools
+import numpy as np
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+ANN_INDEX_FILE = "ivf_index.npz"
+
+# Rows are assigned to centroids in blocks to bound the size of the score matrix
+ASSIGN_BLOCK_ROWS = 16384
+
+# Index versions are unique across instances so a retrained index never matches stale lists
+_versions = itertools.count(1)
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid (by inner product) for every row of a normalized matrix"""
+    assignments = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], ASSIGN_BLOCK_ROWS):
+        block = matrix[start:start + ASSIGN_BLOCK_ROWS]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(
+    matrix: np.ndarray,
+    n_lists: int,
+    iterations: int = 10,
+    sample_size: int = 50000,
+    seed: int = 0
+) -> np.ndarray:
+    """Spherical k-means over a sample of normalized vectors"""
+    rng = np.random.default_rng(seed)
+    if matrix.shape[0] > sample_size:
+        sample = matrix[rng.choice(matrix.shape[0], sample_size, replace=False)]
+    else:
+        sample = matrix
+    n_lists = max(1, min(n_lists, sample.shape[0]))
+
+    centroids = np.array(sample[rng.choice(sample.shape[0], n_lists, replace=False)], dtype=np.float32)
+    for _ in range(iterations):
+        assignments = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+
+        # Re-seed empty lists from random sample points
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()))]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+
+class IVFIndex:
+    """IVF-flat approximate nearest-neighbour index over one course's normalized vectors"""
+
+    # Retrain once the course has grown this much past the size the centroids were trained on
+    RETRAIN_GROWTH = 4.0
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        ids: np.ndarray,
+        document_ids: np.ndarray,
+        assignments: np.ndarray,
+        trained_size: int
+    ):
+        self.centroids = centroids
+        self.ids = ids
+        self.document_ids = document_ids
+        self.assignments = assignments
+        self.trained_size = trained_size
+        # Bumped on every change so cached inverted lists can tell they are stale
+        self.version = next(_versions)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @staticmethod
+    def default_lists(size: int) -> int:
+        """Number of inverted lists for a course of `size` vectors"""
+        return max(1, int(4 * np.sqrt(size)))
+
+    @classmethod
+    def train(
+        cls,
+        ids: np.ndarray,
+        document_ids: np.ndarray,
+        matrix: np.ndarray,
+        n_lists: Optional[int] = None
+    ) -> "IVFIndex":
+        """Train centroids on a course matrix and assign every vector to a list"""
+        n_lists = n_lists or cls.default_lists(matrix.shape[0])
+        centroids = train_centroids(matrix, n_lists)
+        return cls(
+            centroids,
+            np.asarray(ids, dtype=str),
+            np.asarray(document_ids, dtype=str),
+            _assign(matrix, centroids),
+            matrix.shape[0]
+        )
+
+    def needs_retrain(self) -> bool:
+        return len(self) > self.trained_size * self.RETRAIN_GROWTH
+
+    def remove_document(self, document_id: str):
+        keep = self.document_ids != document_id
+        if keep.all():
+            return
+        self.ids = self.ids[keep]
+        self.document_ids = self.document_ids[keep]
+        self.assignments = self.assignments[keep]
+        self.version = next(_versions)
+
+    def add_document(self, document_id: str, ids: List[str], matrix: np.ndarray):
+        """Assign a document's normalized vectors to their nearest lists, replacing earlier rows"""
+        self.remove_document(document_id)
+        if len(ids) == 0:
+            return
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=str)])
+        self.document_ids = np.concatenate([self.document_ids, np.full(len(ids), document_id, dtype=str)])
+        self.assignments = np.concatenate([self.assignments, _assign(matrix, self.centroids)])
+        self.version = next(_versions)
+
+    def assign(self, matrix: np.ndarray) -> np.ndarray:
+        """Nearest list for each row of a normalized matrix"""
+        return _assign(matrix, self.centroids)
+
+    def lookup(self, ids: np.ndarray) -> np.ndarray:
+        """Stored list number for each vector id, or -1 for ids the index hasn't seen"""
+        positions = {vector_id: i for i, vector_id in enumerate(self.ids)}
+        assignments = np.full(len(ids), -1, dtype=np.int32)
+        for row, vector_id in enumerate(ids):
+            position = positions.get(vector_id)
+            if position is not None:
+                assignments[row] = self.assignments[position]
+        return assignments
+
+    def probe(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """The `nprobe` lists whose centroids are closest to a normalized query"""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        scores = self.centroids @ query
+        if nprobe < self.n_lists:
+            return np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.arange(self.n_lists)
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                ids=self.ids,
+                document_ids=self.document_ids,
+                assignments=self.assignments,
+                trained_size=np.array(self.trained_size)
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["IVFIndex"]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return cls(
+                    data["centroids"],
+                    data["ids"],
+                    data["document_ids"],
+                    data["assignments"],
+                    int(data["trained_size"])
+                )
+        except Exception as e:
+            logger.warning(f"Could not load ANN index {path}: {e}")
+            return None
+
+
+class InvertedLists:
+    """Course matrix rows grouped by IVF list, built for one matrix/index pair"""
+
+    def __init__(self, assignments: np.ndarray, n_lists: int, version: int):
+        self.version = version
+        self.order = np.argsort(assignments, kind='stable')
+        self.bounds = np.searchsorted(assignments[self.order], np.arange(n_lists + 1))
+
+    def rows(self, lists: np.ndarray) -> np.ndarray:
+        """Course matrix rows that belong to any of `lists`"""
+        parts = [self.order[self.bounds[i]:self.bounds[i + 1]] for i in lists]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+
+def candidate_rows(lists: InvertedLists, index: IVFIndex, query: np.ndarray, nprobe: int) -> np.ndarray:
+    """Course matrix rows in the lists probed for a query, in row order"""
+    return np.sort(lists.rows(index.probe(query, nprobe)))
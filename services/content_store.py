@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import contextlib
+import numpy as np
+from typing import List, Dict, Set, Tuple
+
+from .vector_segments import atomic_write_json, atomic_write_npy
+
+logger = logging.getLogger(__name__)
+
+# Shared embeddings live in a hidden directory of the embeddings root, next to the course directories.
+# Each pack is an immutable pair:
+#   <pack>.npy        float32 (rows x dim) embeddings, memory-mapped on load
+#   <pack>.keys.json  content key of every row, written last so readers only see complete packs
+# Packs superseded by garbage collection are listed in retired.json until they are deleted.
+CONTENT_DIR = ".content"
+PACK_VECTORS_SUFFIX = ".npy"
+PACK_KEYS_SUFFIX = ".keys.json"
+RETIRED_FILE = "retired.json"
+
+
+def content_key(text: str, model: str, dimension: int) -> str:
+    """Address of an embedding: a hash of the embedding model, its output dimension and the exact chunk text"""
+    return hashlib.sha256(f"{model}\0{dimension}\0{text}".encode('utf-8')).hexdigest()
+
+
+class ContentVectors:
+    """Read-only matrix view over rows scattered across content store packs"""
+
+    def __init__(self, packs: List[np.ndarray], pack_index: np.ndarray, pack_rows: np.ndarray, dimension: int):
+        self._packs = packs
+        self._pack_index = pack_index
+        self._pack_rows = pack_rows
+        self.shape = (len(pack_rows), dimension)
+        self.ndim = 2
+        self.dtype = np.dtype(np.float32)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, selection):
+        if isinstance(selection, (int, np.integer)):
+            return np.asarray(self._packs[self._pack_index[selection]][self._pack_rows[selection]])
+
+        rows = np.arange(self.shape[0])[selection]
+        out = np.empty((len(rows), self.shape[1]), dtype=np.float32)
+        pack_index = self._pack_index[rows]
+        for pack in np.unique(pack_index):
+            mask = pack_index == pack
+            out[mask] = self._packs[pack][self._pack_rows[rows[mask]]]
+        return out
+
+    def locate(self, rows: np.ndarray):
+        """Pack file and row within it for each of `rows`"""
+        files = np.array([pack.filename for pack in self._packs], dtype=object)
+        return files[self._pack_index[rows]], self._pack_rows[rows]
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self[:]
+        return matrix if dtype is None else matrix.astype(dtype)
+
+
+class ContentStore:
+    """Embeddings addressed by content key, shared by every course under one embeddings root"""
+
+    def __init__(self, storage_dir: str):
+        self.content_dir = os.path.join(storage_dir, CONTENT_DIR)
+        os.makedirs(self.content_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # Serializes writing packs with garbage collection
+        self._write_lock = threading.Lock()
+        self._packs: List[np.ndarray] = []
+        self._pack_names: Dict[str, int] = {}
+        self._index: Dict[str, Tuple[int, int]] = {}
+        # Keys held by writers whose segments are not published yet
+        self._held: Dict[str, int] = {}
+        self._refresh()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def nbytes(self) -> int:
+        return int(sum(pack.nbytes for pack in self._packs))
+
+    def _refresh(self):
+        """Pick up packs written since the last scan, including by other processes"""
+        with self._lock:
+            # Read under the lock, so a pack is either still known or already listed as retired
+            retired = self._read_retired()
+            for file_name in sorted(os.listdir(self.content_dir)):
+                if not file_name.endswith(PACK_KEYS_SUFFIX):
+                    continue
+                name = file_name[:-len(PACK_KEYS_SUFFIX)]
+                if name in self._pack_names or name in retired:
+                    continue
+                with open(os.path.join(self.content_dir, file_name), 'r') as f:
+                    keys = json.load(f)
+                pack = np.load(os.path.join(self.content_dir, f"{name}{PACK_VECTORS_SUFFIX}"), mmap_mode='r')
+                pack_number = len(self._packs)
+                self._packs.append(pack)
+                self._pack_names[name] = pack_number
+                for row, key in enumerate(keys):
+                    self._index.setdefault(key, (pack_number, row))
+
+    def reset(self):
+        """Forget every pack, after the embeddings root was wiped"""
+        with self._lock:
+            self._packs = []
+            self._pack_names = {}
+            self._index = {}
+        os.makedirs(self.content_dir, exist_ok=True)
+
+    def missing(self, keys: List[str]) -> List[str]:
+        """Keys without a stored embedding, deduplicated, in first-seen order"""
+        return [key for key in dict.fromkeys(keys) if key not in self._index]
+
+    def get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Stored embeddings for the keys that have one"""
+        with self._lock:
+            packs, index = self._packs, self._index
+        found = {}
+        for key in dict.fromkeys(keys):
+            location = index.get(key)
+            if location is not None:
+                pack, row = location
+                found[key] = np.asarray(packs[pack][row])
+        return found
+
+    def put(self, keys: List[str], vectors: np.ndarray) -> int:
+        """Store embeddings for keys not stored yet as one new pack; returns how many were new"""
+        with self._write_lock:
+            new_rows: Dict[str, int] = {}
+            for row, key in enumerate(keys):
+                if key not in self._index and key not in new_rows:
+                    new_rows[key] = row
+            if not new_rows:
+                return 0
+
+            name = f"pack-{uuid.uuid4().hex}"
+            matrix = np.asarray(vectors, dtype=np.float32)[list(new_rows.values())]
+            self._write_pack(name, matrix, list(new_rows))
+            self._refresh()
+            return len(new_rows)
+
+    @contextlib.contextmanager
+    def hold(self, keys: List[str]):
+        """Keep keys from garbage collection while the segment referencing them is written"""
+        with self._write_lock:
+            for key in keys:
+                self._held[key] = self._held.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._write_lock:
+                for key in keys:
+                    count = self._held.pop(key) - 1
+                    if count:
+                        self._held[key] = count
+
+    def view(self, keys: List[str]) -> ContentVectors:
+        """Matrix view of the embeddings of keys, in order"""
+        if any(key not in self._index for key in keys):
+            self._refresh()
+        with self._lock:
+            packs, index = self._packs, self._index
+        locations = np.array([index[key] for key in keys], dtype=np.int64).reshape(-1, 2)
+        dimension = packs[locations[0, 0]].shape[1] if len(keys) else 0
+        return ContentVectors(packs, locations[:, 0], locations[:, 1], dimension)
+
+    def _write_pack(self, name: str, matrix: np.ndarray, keys: List[str]):
+        atomic_write_npy(os.path.join(self.content_dir, f"{name}{PACK_VECTORS_SUFFIX}"), matrix)
+        atomic_write_json(os.path.join(self.content_dir, f"{name}{PACK_KEYS_SUFFIX}"), keys)
+
+    def _read_retired(self) -> Dict[str, float]:
+        try:
+            with open(os.path.join(self.content_dir, RETIRED_FILE), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _purge_retired(self, grace_seconds: float) -> int:
+        """Delete packs retired more than grace_seconds ago"""
+        retired = self._read_retired()
+        cutoff = time.time() - grace_seconds
+        expired = [name for name, retired_at in retired.items() if retired_at <= cutoff]
+        for name in expired:
+            # The keys file goes first, so the pack is never found without its vectors
+            for suffix in (PACK_KEYS_SUFFIX, PACK_VECTORS_SUFFIX):
+                path = os.path.join(self.content_dir, f"{name}{suffix}")
+                if os.path.exists(path):
+                    os.remove(path)
+            del retired[name]
+        if expired:
+            atomic_write_json(os.path.join(self.content_dir, RETIRED_FILE), retired)
+        return len(expired)
+
+    def collect(self, live_keys: Set[str], grace_seconds: float, small_rows: int) -> int:
+        """Rewrite packs holding embeddings no segment references, merging small packs along the way.
+
+        Held keys and packs written within grace_seconds count as live, since
+        the segments referencing them may not be published yet. Replaced packs
+        are retired, not deleted, so searches reading them can finish; a later
+        pass purges them. Returns how many packs were replaced.
+        """
+        with self._write_lock:
+            self._purge_retired(grace_seconds)
+            self._refresh()
+            now = time.time()
+            live_keys = live_keys | set(self._held)
+            with self._lock:
+                packs, pack_names, index = self._packs, self._pack_names, self._index
+            names = {number: name for name, number in pack_names.items()}
+
+            # Rows still in use per pack; a key stored twice is only in use where the index points
+            live: Dict[int, List[Tuple[int, str]]] = {number: [] for number in names}
+            for key, (number, row) in index.items():
+                if key in live_keys:
+                    live[number].append((row, key))
+
+            # Packs with dead rows are rewritten; small packs are merged once there are two of a dimension
+            dirty: Dict[int, List[int]] = {}
+            small: Dict[int, List[int]] = {}
+            for number, name in names.items():
+                keys_path = os.path.join(self.content_dir, f"{name}{PACK_KEYS_SUFFIX}")
+                if now - os.path.getmtime(keys_path) < grace_seconds:
+                    continue
+                dimension = packs[number].shape[1]
+                if len(live[number]) < len(packs[number]):
+                    dirty.setdefault(dimension, []).append(number)
+                elif len(packs[number]) < small_rows:
+                    small.setdefault(dimension, []).append(number)
+            groups = []
+            for dimension in set(dirty) | set(small):
+                numbers = dirty.get(dimension, []) + small.get(dimension, [])
+                groups.append(numbers if len(numbers) > 1 else dirty.get(dimension, []))
+            replaced = [number for numbers in groups for number in numbers]
+            if not replaced:
+                return 0
+
+            written = []
+            for numbers in groups:
+                rows = [(number, sorted(live[number])) for number in numbers if live[number]]
+                if not rows:
+                    continue
+                name = f"pack-{uuid.uuid4().hex}"
+                matrix = np.concatenate([packs[number][[row for row, _ in entries]] for number, entries in rows])
+                keys = [key for _, entries in rows for _, key in entries]
+                self._write_pack(name, matrix, keys)
+                written.append((name, keys))
+
+            retired = self._read_retired()
+            retired.update({names[number]: now for number in replaced})
+            atomic_write_json(os.path.join(self.content_dir, RETIRED_FILE), retired)
+
+            # Views handed out earlier keep the old pack list, so the new state is built beside it
+            replaced_set = set(replaced)
+            kept = [number for number in sorted(names) if number not in replaced_set]
+            renumber = {number: i for i, number in enumerate(kept)}
+            new_packs = [packs[number] for number in kept]
+            new_names = {names[number]: i for i, number in enumerate(kept)}
+            new_index = {key: (renumber[number], row) for key, (number, row) in index.items() if number in renumber}
+            for name, keys in written:
+                pack_number = len(new_packs)
+                new_packs.append(np.load(os.path.join(self.content_dir, f"{name}{PACK_VECTORS_SUFFIX}"), mmap_mode='r'))
+                new_names[name] = pack_number
+                for row, key in enumerate(keys):
+                    new_index.setdefault(key, (pack_number, row))
+            with self._lock:
+                self._packs, self._pack_names, self._index = new_packs, new_names, new_index
+
+            dropped = sum(len(packs[number]) - len(live[number]) for number in replaced)
+            logger.info(f"Replaced {len(replaced)} content packs with {len(written)}, dropping {dropped} unused embeddings")
+            return len(replaced)
+
+
+_stores: Dict[str, ContentStore] = {}
+_stores_lock = threading.Lock()
+
+
+def content_store_for(storage_dir: str) -> ContentStore:
+    """The content store of an embeddings root, shared by everything in this process"""
+    storage_dir = os.path.abspath(storage_dir)
+    with _stores_lock:
+        store = _stores.get(storage_dir)
+        if store is None:
+            store = ContentStore(storage_dir)
+            _stores[storage_dir] = store
+        return store
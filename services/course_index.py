@@ -0,0 +1,104 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from .vector_segments import COURSE_INFO_FILE, atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+COURSE_INDEX_FILE = "course_index.json"
+
+
+class CourseDirectoryIndex:
+    """Persistent course id -> directory name manifest for the embeddings root"""
+
+    def __init__(self, storage_dir: str):
+        self.storage_dir = storage_dir
+        self.index_path = os.path.join(storage_dir, COURSE_INDEX_FILE)
+        self._dirs: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Load the index file, rebuilding it from the course directories when missing or unreadable"""
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as f:
+                    dirs = json.load(f)
+                with self._lock:
+                    self._dirs = dict(dirs)
+                logger.info(f"Loaded course index with {len(dirs)} courses from {self.index_path}")
+                return
+            except Exception as e:
+                logger.warning(f"Could not read course index {self.index_path}, rebuilding: {e}")
+        self.rebuild()
+
+    def rebuild(self):
+        """Scan the embeddings root once and rewrite the index file"""
+        dirs = {}
+        for dir_name in sorted(os.listdir(self.storage_dir)):
+            dir_path = os.path.join(self.storage_dir, dir_name)
+            # Dot directories are courses being deleted
+            if dir_name.startswith('.') or not os.path.isdir(dir_path):
+                continue
+
+            course_id = None
+            mapping_file = os.path.join(dir_path, COURSE_INFO_FILE)
+            if os.path.exists(mapping_file):
+                try:
+                    with open(mapping_file, 'r') as f:
+                        course_id = json.load(f).get("id")
+                except Exception:
+                    pass
+
+            # Directories from before course_info.json are named <course_id> or <course_id>_<suffix>
+            if not course_id:
+                course_id = dir_name.split('_')[0]
+
+            # Named folders win over legacy id folders for the same course
+            if course_id not in dirs or os.path.exists(mapping_file):
+                dirs[course_id] = dir_name
+
+        with self._lock:
+            self._dirs = dirs
+            self._save()
+        logger.info(f"Rebuilt course index with {len(dirs)} courses")
+
+    def _save(self):
+        atomic_write_json(self.index_path, self._dirs)
+
+    def get(self, course_id: str) -> Optional[str]:
+        """Get the absolute directory of an indexed course whose directory still exists"""
+        with self._lock:
+            dir_name = self._dirs.get(course_id)
+        if dir_name is None:
+            return None
+
+        dir_path = os.path.join(self.storage_dir, dir_name)
+        if not os.path.isdir(dir_path):
+            self.remove(course_id)
+            return None
+        return dir_path
+
+    def course_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._dirs)
+
+    def set(self, course_id: str, dir_name: str):
+        with self._lock:
+            if self._dirs.get(course_id) == dir_name:
+                return
+            self._dirs[course_id] = dir_name
+            self._save()
+
+    def remove(self, course_id: str):
+        with self._lock:
+            if self._dirs.pop(course_id, None) is not None:
+                self._save()
+
+    def clear(self):
+        with self._lock:
+            self._dirs = {}
+            self._save()
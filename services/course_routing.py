@@ -0,0 +1,68 @@
+import os
+import logging
+import numpy as np
+from typing import Optional
+
+from .ann_index import train_centroids
+
+logger = logging.getLogger(__name__)
+
+ROUTING_FILE = "course_centroids.npz"
+
+# Quantized scores can land slightly above the bound computed from dequantized rows
+ROUTING_SLACK = 0.01
+
+
+class CourseCentroids:
+    """A few k-means centroids of one course, each with the widest angle between it and its rows.
+
+    A row within angle t of its centroid c scores at most cos(angle(q, c) - t)
+    against a query q, so the best score of any row in the course is bounded
+    without reading the course's vectors.
+    """
+
+    def __init__(self, centroids: np.ndarray, max_angles: np.ndarray):
+        self.centroids = centroids
+        self.max_angles = max_angles
+
+    @property
+    def dimension(self) -> int:
+        return self.centroids.shape[1]
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, n_centroids: int) -> "CourseCentroids":
+        """Summarize the normalized rows of a course matrix"""
+        centroids = train_centroids(matrix, n_centroids)
+        # Few centroids, so the full rows x centroids product stays small
+        scores = matrix @ centroids.T
+        assignments = np.argmax(scores, axis=1)
+        similarity = scores[np.arange(len(assignments)), assignments]
+        # Lowest similarity to the centroid per cluster; clusters left without rows never bound anything
+        lowest = np.full(len(centroids), np.inf, dtype=np.float32)
+        np.minimum.at(lowest, assignments, similarity)
+        max_angles = np.where(np.isinf(lowest), -np.inf, np.arccos(np.clip(lowest, -1.0, 1.0)))
+        return cls(centroids, max_angles.astype(np.float32))
+
+    def upper_bound(self, query: np.ndarray) -> float:
+        """Highest cosine score any row of the course can reach for a unit query"""
+        used = np.isfinite(self.max_angles)
+        angles = np.arccos(np.clip(self.centroids[used] @ query, -1.0, 1.0))
+        gaps = np.maximum(angles - self.max_angles[used], 0.0)
+        return float(np.max(np.cos(gaps), initial=-1.0)) + ROUTING_SLACK
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, max_angles=self.max_angles)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["CourseCentroids"]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return cls(data["centroids"], data["max_angles"])
+        except Exception as e:
+            logger.warning(f"Could not load course centroids {path}: {e}")
+            return None
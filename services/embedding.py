@@ -7,6 +7,13 @@ import uuid
 from openai import AsyncOpenAI
 from sentence_transformers import SentenceTransformer
 from .file_vector_store import FileVectorStore
+from .sqlite_vector_store import SQLiteVectorStore
+from .lexical_index import reciprocal_rank_fusion
+from .content_store import content_key
+from .query_cache import QueryEmbeddingCache
+from .embedding_batcher import EmbeddingBatcher
+from .openai_embeddings import OpenAIEmbeddingBatcher
+from .embedding_workers import LocalEmbeddingPool
 from sqlalchemy.ext.asyncio import AsyncSession
 
 logger = logging.getLogger(__name__)
@@ -16,6 +23,8 @@ class EmbeddingService:
         self.model = None
         self.vector_store = None
         self.openai_client = None
+        self.openai_batcher = None
+        self.embedding_pool = None
         self.provider = os.getenv("EMBEDDING_MODEL_PROVIDER", "local")
         self.model_name = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
         self.vector_size = int(os.getenv("VECTOR_DIMENSION", "384"))
@@ -29,15 +38,46 @@ class EmbeddingService:
             elif self.model_name == "text-embedding-ada-002":
                 self.vector_size = 1536
         
+        # Repeated queries reuse their embedding; QUERY_CACHE_PATH adds a tier that survives restarts
+        self.query_cache = QueryEmbeddingCache(
+            max_entries=int(os.getenv("QUERY_CACHE_SIZE", "1024")),
+            path=os.getenv("QUERY_CACHE_PATH") or None,
+            max_disk_entries=int(os.getenv("QUERY_CACHE_DISK_ENTRIES", "100000"))
+        )
+        
+        # Concurrent single-text embeddings are coalesced into one embed_texts call
+        self.batcher = EmbeddingBatcher(
+            lambda texts: self.embed_texts(texts, interactive=True),
+            max_batch=int(os.getenv("EMBED_BATCH_SIZE", "32")),
+            max_wait_ms=float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+        )
+    
+    @property
+    def model_key(self) -> str:
+        """Identifies the embedding model in content-addressed keys"""
+        return f"{self.provider}/{self.model_name}"
+        
     async def initialize(self):
         """Initialize the embedding model and vector storage"""
         try:
             # Initialize embedding model based on provider
             if self.provider == "local":
                 logger.info(f"Loading local embedding model: {self.model_name}")
-                self.model = SentenceTransformer(self.model_name)
-                if self.model_name == "all-MiniLM-L6-v2":
-                    self.vector_size = 384
+                workers = int(os.getenv("EMBED_WORKERS", "0"))
+                if workers > 0:
+                    # Replicas live in worker processes, so none is loaded here
+                    self.embedding_pool = LocalEmbeddingPool(
+                        self.model_name,
+                        workers,
+                        torch_threads=int(os.getenv("EMBED_TORCH_THREADS", "0")) or None,
+                        batch_size=int(os.getenv("EMBED_WORKER_BATCH", "64"))
+                    )
+                    dimension = await self.embedding_pool.start()
+                else:
+                    self.model = SentenceTransformer(self.model_name)
+                    dimension = self.model.get_sentence_embedding_dimension()
+                # The model knows its dimension; VECTOR_DIMENSION only covers models that do not report one
+                self.vector_size = dimension or self.vector_size
                 logger.info("Local embedding model loaded successfully")
             elif self.provider == "openai":
                 logger.info(f"Using OpenAI embedding model: {self.model_name}")
@@ -45,8 +85,16 @@ class EmbeddingService:
                 if not api_key:
                     raise ValueError("OpenAI API key not provided")
                 
-                # Initialize OpenAI client
-                self.openai_client = AsyncOpenAI(api_key=api_key)
+                # Initialize OpenAI client; retries are left to the batcher, which also honours Retry-After
+                self.openai_client = AsyncOpenAI(api_key=api_key, max_retries=0)
+                self.openai_batcher = OpenAIEmbeddingBatcher(
+                    self.openai_client,
+                    self.model_name,
+                    max_tokens=int(os.getenv("OPENAI_EMBED_BATCH_TOKENS", "100000")),
+                    max_inputs=int(os.getenv("OPENAI_EMBED_BATCH_SIZE", "512")),
+                    max_concurrency=int(os.getenv("OPENAI_EMBED_CONCURRENCY", "4")),
+                    max_retries=int(os.getenv("OPENAI_EMBED_MAX_RETRIES", "5"))
+                )
                 
                 # Test OpenAI connection
                 try:
@@ -56,9 +104,13 @@ class EmbeddingService:
                     logger.error(f"Failed to connect to OpenAI: {e}")
                     raise
             
-            # Initialize file vector store
-            self.vector_store = FileVectorStore()
-            logger.info("File vector store initialized successfully")
+            # Initialize the vector store: segment files, or BLOBs in the application database
+            if os.getenv("VECTOR_STORE_BACKEND", "file") == "sqlite":
+                self.vector_store = SQLiteVectorStore()
+            else:
+                self.vector_store = FileVectorStore()
+            self.vector_store.start_compactor()
+            logger.info(f"{type(self.vector_store).__name__} initialized successfully")
             
         except Exception as e:
             logger.error(f"Failed to initialize embedding service: {e}")
@@ -86,67 +138,36 @@ class EmbeddingService:
             raise
     
     async def _openai_embed_texts(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for multiple texts using OpenAI API"""
+        """Generate embeddings for multiple texts using OpenAI API, in concurrent token-sized batches"""
         try:
-            # OpenAI has a limit on batch size, so we'll process in chunks
-            batch_size = 100
-            all_embeddings = []
-            
-            for i in range(0, len(texts), batch_size):
-                batch = texts[i:i + batch_size]
-                response = await self.openai_client.embeddings.create(
-                    model=self.model_name,
-                    input=batch
-                )
-                
-                # Add null checks
-                if not response or not response.data:
-                    raise ValueError(f"OpenAI API returned empty response for batch {i//batch_size + 1}")
-                
-                if len(response.data) != len(batch):
-                    raise ValueError(f"OpenAI API returned {len(response.data)} embeddings for {len(batch)} texts")
-                
-                batch_embeddings = []
-                for item in response.data:
-                    if not item or not item.embedding:
-                        raise ValueError("OpenAI API returned empty embedding in batch")
-                    batch_embeddings.append(item.embedding)
-                
-                all_embeddings.extend(batch_embeddings)
-            
-            return all_embeddings
+            return await self.openai_batcher.embed(texts)
         except Exception as e:
             logger.error(f"OpenAI batch embedding error: {e}")
             raise
     
     async def embed_text(self, text: str) -> List[float]:
-        """Generate embedding for a single text"""
+        """Generate embedding for a single text, reusing the cached embedding of a repeated query"""
+        key = self.query_cache.key(text, self.model_key)
+        cached = await self.query_cache.get(key)
+        if cached is not None:
+            return cached.tolist()
+        
         try:
-            if self.provider == "openai":
-                return await self._openai_embed_text(text)
-            else:
-                if not self.model:
-                    raise RuntimeError("Local embedding model not initialized")
-                
-                # Run embedding in thread pool to avoid blocking
-                loop = asyncio.get_event_loop()
-                embedding = await loop.run_in_executor(
-                    None, 
-                    self.model.encode, 
-                    text
-                )
-                
-                return embedding.tolist()
+            # Batched with other requests arriving within the batch window
+            embedding = await self.batcher.embed(text)
+            return (await self.query_cache.put(key, embedding)).tolist()
                 
         except Exception as e:
             logger.error(f"Error generating embedding: {e}")
             raise
     
-    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for multiple texts"""
+    async def embed_texts(self, texts: List[str], interactive: bool = False) -> List[List[float]]:
+        """Generate embeddings for multiple texts; interactive requests are never queued behind bulk work"""
         try:
             if self.provider == "openai":
                 return await self._openai_embed_texts(texts)
+            elif self.embedding_pool is not None:
+                return (await self.embedding_pool.embed(texts, interactive)).tolist()
             else:
                 if not self.model:
                     raise RuntimeError("Local embedding model not initialized")
@@ -181,21 +202,33 @@ class EmbeddingService:
             # Extract texts for embedding
             texts = [chunk['content'] for chunk in chunks]
             
-            logger.info(f"Generating embeddings for {len(texts)} chunks in document {document_id}")
+            # Chunks already embedded with this model and dimension, in any course or an earlier upload, are reused
+            keys = [content_key(text, self.model_key, self.vector_size) for text in texts]
+            known = await self.vector_store.run_io(self.vector_store.lookup_embeddings, keys)
+            missing = {key: text for key, text in zip(keys, texts) if key not in known}
+            
+            logger.info(
+                f"Embedding cache for document {document_id}: {len(texts) - len(missing)} of {len(texts)} chunks hit, "
+                f"generating {len(missing)} embeddings"
+            )
             # Generate embeddings
-            embeddings = await self.embed_texts(texts)
-            logger.info(f"Successfully generated {len(embeddings)} embeddings using {self.provider} provider")
+            if missing:
+                new_embeddings = await self.embed_texts(list(missing.values()))
+                known.update(zip(missing.keys(), new_embeddings))
+                logger.info(f"Successfully generated {len(new_embeddings)} embeddings using {self.provider} provider")
+            embeddings = [known[key] for key in keys]
             
             # Prepare vectors for storage
             vectors = []
             
             for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                # Use UUID for vector ID
-                vector_id = str(uuid.uuid4())
+                # Chunks stored in the database share their id with their vector
+                vector_id = chunk.get('id') or str(uuid.uuid4())
                 
                 vector = {
                     "id": vector_id,
                     "vector": embedding,
+                    "content_key": keys[i],
                     "payload": {
                         "course_id": course_id,
                         "document_id": document_id,
@@ -232,7 +265,12 @@ class EmbeddingService:
         course_id: str,
         limit: int = 10,
         score_threshold: float = 0.7,
-        db_session: Optional[AsyncSession] = None
+        db_session: Optional[AsyncSession] = None,
+        search_mode: Optional[str] = None,
+        nprobe: Optional[int] = None,
+        filters: Optional[Dict[str, List[str]]] = None,
+        mmr_lambda: Optional[float] = None,
+        mmr_pool: Optional[int] = None
     ) -> List[Dict]:
         """Search for similar content using embeddings"""
         try:
@@ -245,7 +283,12 @@ class EmbeddingService:
                 course_id, 
                 limit=limit,
                 score_threshold=score_threshold,
-                db_session=db_session
+                db_session=db_session,
+                search_mode=search_mode,
+                nprobe=nprobe,
+                filters=filters,
+                mmr_lambda=mmr_lambda,
+                mmr_pool=mmr_pool
             )
             
             return results
@@ -254,6 +297,128 @@ class EmbeddingService:
             logger.error(f"Error searching similar content: {e}")
             return []
     
+    async def index_text(self, course_id: str, document_id: str, vector_ids: List[str], texts: List[str]) -> bool:
+        """Add a document's chunk text to the course's lexical (BM25) index"""
+        return await self.vector_store.index_text(course_id, document_id, vector_ids, texts)
+    
+    async def search_lexical(
+        self,
+        query: str,
+        course_id: str,
+        limit: int = 10,
+        db_session: Optional[AsyncSession] = None,
+        filters: Optional[Dict[str, List[str]]] = None
+    ) -> List[Dict]:
+        """Search for content matching the query's terms with BM25"""
+        return await self.vector_store.search_lexical(
+            query, course_id, limit=limit, db_session=db_session, filters=filters
+        )
+    
+    async def search_hybrid(
+        self,
+        query: str,
+        course_id: str,
+        limit: int = 10,
+        score_threshold: float = 0.7,
+        db_session: Optional[AsyncSession] = None,
+        search_mode: Optional[str] = None,
+        nprobe: Optional[int] = None,
+        filters: Optional[Dict[str, List[str]]] = None
+    ) -> List[Dict]:
+        """Search with embeddings and BM25 and fuse both rankings with reciprocal-rank fusion"""
+        try:
+            # Fuse deeper candidate lists than the final limit so either side can promote a result
+            candidates = max(limit * 4, 20)
+            vector_results, lexical_results = await asyncio.gather(
+                self.search_similar(
+                    query, course_id, limit=candidates, score_threshold=score_threshold,
+                    db_session=db_session, search_mode=search_mode, nprobe=nprobe, filters=filters
+                ),
+                self.search_lexical(query, course_id, limit=candidates, db_session=db_session, filters=filters)
+            )
+            return reciprocal_rank_fusion({"vector": vector_results, "lexical": lexical_results}, limit)
+            
+        except Exception as e:
+            logger.error(f"Error in hybrid search: {e}")
+            return []
+    
+    async def search_courses(
+        self,
+        query: str,
+        course_ids: List[str],
+        limit: int = 10,
+        score_threshold: float = 0.7,
+        search_mode: Optional[str] = None,
+        nprobe: Optional[int] = None,
+        filters: Optional[Dict[str, List[str]]] = None
+    ) -> List[Dict]:
+        """Search several courses with one query embedding, skipping courses that cannot match"""
+        try:
+            query_embedding = await self.embed_text(query)
+            return await self.vector_store.search_courses(
+                query_embedding,
+                course_ids,
+                limit=limit,
+                score_threshold=score_threshold,
+                search_mode=search_mode,
+                nprobe=nprobe,
+                filters=filters
+            )
+        except Exception as e:
+            logger.error(f"Error searching courses: {e}")
+            return []
+    
+    async def search_similar_many(
+        self,
+        queries: List[str],
+        course_id: str,
+        limit: int = 10,
+        score_threshold: float = 0.7,
+        db_session: Optional[AsyncSession] = None,
+        search_mode: Optional[str] = None,
+        nprobe: Optional[int] = None,
+        filters: Optional[Dict[str, List[str]]] = None
+    ) -> List[List[Dict]]:
+        """Search for several queries at once, embedding the uncached ones in one batch"""
+        try:
+            if not queries:
+                return []
+            
+            # Repeated queries come from the query cache; the rest are embedded in one interactive call
+            keys = [self.query_cache.key(query, self.model_key) for query in queries]
+            query_embeddings: List[Optional[List[float]]] = [None] * len(queries)
+            misses: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                cached = await self.query_cache.get(key)
+                if cached is not None:
+                    query_embeddings[i] = cached.tolist()
+                else:
+                    misses.setdefault(key, []).append(i)
+            
+            if misses:
+                texts = [queries[positions[0]] for positions in misses.values()]
+                embeddings = await self.embed_texts(texts, interactive=True)
+                for (key, positions), embedding in zip(misses.items(), embeddings):
+                    embedding = (await self.query_cache.put(key, embedding)).tolist()
+                    for i in positions:
+                        query_embeddings[i] = embedding
+
+            # Search in vector store
+            return await self.vector_store.search_similar_many(
+                query_embeddings,
+                course_id,
+                limit=limit,
+                score_threshold=score_threshold,
+                db_session=db_session,
+                search_mode=search_mode,
+                nprobe=nprobe,
+                filters=filters
+            )
+            
+        except Exception as e:
+            logger.error(f"Error searching similar content for {len(queries)} queries: {e}")
+            return [[] for _ in queries]
+    
     async def delete_document_embeddings(self, document_id: str, course_id: str, db_session: Optional[AsyncSession] = None):
         """Delete embeddings for a document"""
         try:
@@ -283,20 +448,46 @@ class EmbeddingService:
     async def get_collection_info(self) -> Dict:
         """Get information about the vector collection"""
         try:
-            # For file store, we just return basic info
+            # Counts come from the per-course manifests the vector store maintains
+            stats = await self.vector_store.run_io(self.vector_store.get_stats)
             return {
                 "status": "active",
-                "vector_count": -1,  # Unknown without scanning all files
-                "storage_type": "file"
+                "vector_count": stats["vectors"],
+                "document_count": stats["documents"],
+                "course_count": stats["course_count"],
+                "bytes_on_disk": stats["bytes"],
+                "last_modified": stats["last_modified"],
+                "vector_size": self.vector_size,
+                "storage_type": "sqlite" if isinstance(self.vector_store, SQLiteVectorStore) else "file",
+                "courses": stats["courses"],
+                "resident": stats["resident"],
+                "query_cache": self.query_cache.stats(),
+                "embedding_batches": self.batcher.stats(),
+                "openai_embeddings": self.openai_batcher.stats() if self.openai_batcher else None,
+                "embedding_workers": self.embedding_pool.stats() if self.embedding_pool else None
             }
         except Exception as e:
             logger.error(f"Error getting collection info: {e}")
             return {"status": "error", "error": str(e)}
     
+    async def get_course_stats(self, course_id: str) -> Optional[Dict]:
+        """Get vector statistics for one course, per document included"""
+        return await self.vector_store.run_io(self.vector_store.get_course_stats, course_id)
+    
+    async def warm_up(self, course_ids: List[str], memory_budget: int) -> Dict:
+        """Preload the search indexes of the given courses, most important first, within a memory budget"""
+        return await self.vector_store.run_io(self.vector_store.warm_up, course_ids, memory_budget)
+    
     async def cleanup(self):
         """Clean up resources"""
-        # No cleanup needed for file storage
-        pass
+        await self.batcher.close()
+        if self.embedding_pool is not None:
+            self.embedding_pool.shutdown()
+        if self.vector_store is not None:
+            await self.vector_store.stop_compactor()
+            self.vector_store.shutdown_shard_pool()
+            self.vector_store.shutdown_io_pool()
+        self.query_cache.close()
 
 # Global instance
 embedding_service = EmbeddingService() 
\ No newline at end of file
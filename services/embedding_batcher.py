@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from typing import List, Dict, Any, Callable, Awaitable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent single-text embedding requests into batches.
+
+    The first pending text opens a window of max_wait_ms; the batch is sent
+    when the window closes or max_batch texts are waiting, whichever comes
+    first. Each caller gets its own vector, or the batch's exception.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], Awaitable[List]], max_batch: int = 32, max_wait_ms: float = 5.0):
+        self.embed_batch = embed_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.requests = 0
+        self.batches = 0
+        self.full_batches = 0
+        self.largest_batch = 0
+        self.failed_batches = 0
+
+    async def embed(self, text: str):
+        """Embedding of one text, computed in a batch with whatever else arrives meanwhile"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.requests += 1
+
+        if len(self._pending) >= self.max_batch:
+            self.full_batches += 1
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        # The same text asked for twice in one window is embedded once
+        unique = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            vectors = dict(zip(unique, await self.embed_batch(unique)))
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error(f"Error embedding a batch of {len(unique)} texts: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for text, future in batch:
+            # Callers that gave up (cancelled requests) are skipped
+            if not future.done():
+                future.set_result(vectors[text])
+
+    async def close(self):
+        """Send what is still pending and wait for batches in flight"""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "requests": self.requests,
+            "batches": self.batches,
+            "full_batches": self.full_batches,
+            "failed_batches": self.failed_batches,
+            "largest_batch": self.largest_batch,
+            "mean_batch_size": self.requests / self.batches if self.batches else None,
+            "mean_fill": self.requests / (self.batches * self.max_batch) if self.batches else None
+        }
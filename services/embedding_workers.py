@@ -0,0 +1,106 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# The model replica of a worker process, loaded by its initializer
+_model = None
+
+
+def _init_worker(model_name: str, torch_threads: int):
+    """Load this worker's replica of the model, limiting torch to its share of the cores"""
+    global _model
+    # Set before torch loads so its OpenMP pool is sized for this worker, not the whole machine
+    os.environ["OMP_NUM_THREADS"] = str(torch_threads)
+    os.environ["MKL_NUM_THREADS"] = str(torch_threads)
+    import torch
+    from sentence_transformers import SentenceTransformer
+    torch.set_num_threads(torch_threads)
+    _model = SentenceTransformer(model_name)
+
+
+def _dimension() -> int:
+    return _model.get_sentence_embedding_dimension()
+
+
+def _encode(texts: List[str]) -> np.ndarray:
+    return np.asarray(_model.encode(texts), dtype=np.float32)
+
+
+class LocalEmbeddingPool:
+    """Worker processes, each holding one replica of a local embedding model, fed from one shared queue.
+
+    Texts are encoded in sub-batches of at most batch_size, so a query
+    waits behind at most one sub-batch per worker. Bulk work may occupy
+    all workers but one, which stays free for interactive requests.
+    """
+
+    def __init__(self, model_name: str, processes: int, torch_threads: Optional[int] = None, batch_size: int = 64):
+        self.model_name = model_name
+        self.processes = max(1, processes)
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // self.processes)
+        self.batch_size = max(1, batch_size)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._bulk_slots = asyncio.Semaphore(max(1, self.processes - 1))
+        self.interactive_batches = 0
+        self.bulk_batches = 0
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned workers start without torch state or threads inherited from this process
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.model_name, self.torch_threads)
+            )
+        return self._pool
+
+    async def start(self) -> int:
+        """Start the workers and return the model's embedding dimension"""
+        loop = asyncio.get_running_loop()
+        logger.info(f"Starting {self.processes} embedding workers with {self.torch_threads} torch threads each")
+        return await loop.run_in_executor(self._get_pool(), _dimension)
+
+    async def _encode(self, texts: List[str], interactive: bool) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        if interactive:
+            self.interactive_batches += 1
+            return await loop.run_in_executor(self._get_pool(), _encode, texts)
+        async with self._bulk_slots:
+            self.bulk_batches += 1
+            return await loop.run_in_executor(self._get_pool(), _encode, texts)
+
+    async def embed(self, texts: List[str], interactive: bool = False) -> np.ndarray:
+        """Embeddings of texts, in order, as a float32 matrix"""
+        try:
+            parts = await asyncio.gather(*[
+                self._encode(texts[start:start + self.batch_size], interactive)
+                for start in range(0, len(texts), self.batch_size)
+            ])
+        except BrokenProcessPool:
+            # A worker died; the next call starts a fresh pool
+            logger.error("Embedding worker pool failed; it will be restarted on the next request")
+            self.shutdown()
+            raise
+        return np.vstack(parts) if parts else np.empty((0, 0), dtype=np.float32)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "processes": self.processes,
+            "torch_threads": self.torch_threads,
+            "batch_size": self.batch_size,
+            "interactive_batches": self.interactive_batches,
+            "bulk_batches": self.bulk_batches
+        }
@@ -1,18 +1,48 @@
 import os
+import copy
 import json
+import uuid
+import shutil
+import asyncio
 import logging
+import functools
+import threading
+import multiprocessing
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from sqlalchemy.orm import Session
 from models.database import Course
+from .vector_segments import COURSE_INFO_FILE, VECTORS_SUFFIX, is_store_file, load_segment, segment_content_keys
+from .segment_log import SegmentLog
+from .vector_cache import CourseMatrix, CourseMatrixCache
+from .vector_search import normalize_query, normalize_queries, select_top_k, mmr_select
+from .ann_index import ANN_INDEX_FILE, IVFIndex, InvertedLists, candidate_rows
+from .quantization import QUANTIZATION_MODES, resident_row_bytes
+from .lexical_index import LEXICAL_INDEX_FILE, BM25Index
+from .sharded_search import plan_shards, score_shard
+from .content_store import content_store_for
+from .course_routing import ROUTING_FILE, CourseCentroids
+from .course_index import CourseDirectoryIndex
 
 logger = logging.getLogger(__name__)
 
+# Values accepted for the search mode, per request or through VECTOR_SEARCH_MODE
+SEARCH_MODES = ("auto", "exact", "ann", "sharded")
+
+def _on_io_pool(method):
+    """Make a blocking store method awaitable, running it on the store's I/O thread pool"""
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        return await self.run_io(method, self, *args, **kwargs)
+    return wrapper
+
 class FileVectorStore:
-    """Simple file-based vector store for embeddings"""
+    """File-based vector store keeping each course as a log of memory-mapped binary segments"""
     
     def __init__(self, storage_dir: str = None):
         if storage_dir is None:
@@ -22,7 +52,81 @@ class FileVectorStore:
         else:
             self.storage_dir = storage_dir
         
+        # Course matrices stay resident so repeat searches skip file I/O, up to VECTOR_CACHE_MB;
+        # least recently searched courses beyond that are evicted, except VECTOR_PINNED_COURSES
+        self.cache = CourseMatrixCache(
+            max_bytes=int(float(os.getenv("VECTOR_CACHE_MB", "0")) * 1024 * 1024),
+            pinned=[c.strip() for c in os.getenv("VECTOR_PINNED_COURSES", "").split(",") if c.strip()],
+            on_evict=self._drop_course_indexes
+        )
+        
         self._ensure_dir_exists()
+        
+        # Embeddings addressed by chunk text and model, shared by all courses
+        self.content_store = content_store_for(self.storage_dir)
+        
+        # Course id -> directory manifest, built once instead of scanning per lookup
+        self.course_index = CourseDirectoryIndex(self.storage_dir)
+        
+        # Approximate search: "auto" switches to the IVF index above the size threshold,
+        # "exact" always scans the full course, "ann" always uses the index and
+        # "sharded" scans the full course across worker processes
+        self.search_mode = os.getenv("VECTOR_SEARCH_MODE", "auto")
+        if self.search_mode not in SEARCH_MODES:
+            logger.warning(f"Unknown VECTOR_SEARCH_MODE {self.search_mode}, using auto")
+            self.search_mode = "auto"
+        self.ann_threshold = int(os.getenv("VECTOR_ANN_THRESHOLD", "50000"))
+        self.ann_nprobe = int(os.getenv("VECTOR_ANN_NPROBE", "8"))
+        self.ann_indexes: Dict[str, Optional[IVFIndex]] = {}
+        
+        # "sharded" search splits an exact scan across worker processes that memory-map the segments
+        self.shard_workers = int(os.getenv("VECTOR_SHARD_WORKERS") or os.cpu_count() or 1)
+        self._shard_pool: Optional[ProcessPoolExecutor] = None
+        
+        # Per-course BM25 indexes over chunk text, for exact identifiers embeddings miss
+        self.lexical_indexes: Dict[str, BM25Index] = {}
+        # A few centroids per course bound the best score a course can reach, so multi-course
+        # searches skip courses that cannot contribute
+        self.routing_centroids = int(os.getenv("VECTOR_ROUTING_CENTROIDS", "8"))
+        self.course_centroids: Dict[str, CourseCentroids] = {}
+        # Index updates copy the index, change the copy and swap it in, one writer at a time,
+        # so searches on other threads always read a complete index
+        self._index_lock = threading.Lock()
+        
+        # File I/O and NumPy scoring run on a bounded thread pool instead of the event loop
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._load_locks_lock = threading.Lock()
+        self.io_workers = max(1, int(os.getenv("VECTOR_IO_WORKERS", "4")))
+        self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="vector-io")
+        
+        # Resident matrices can be held as float16 or int8 codes; the top
+        # limit * VECTOR_RESCORE_FACTOR candidates are then rescored at full precision
+        self.quantization = os.getenv("VECTOR_QUANTIZATION", "none")
+        if self.quantization not in QUANTIZATION_MODES:
+            logger.warning(f"Unknown VECTOR_QUANTIZATION {self.quantization}, storing float32 vectors")
+            self.quantization = "none"
+        self.rescore_factor = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
+        
+        # One segment log per course directory; writes append segments that compaction later merges
+        self.segment_logs: Dict[str, SegmentLog] = {}
+        self._segment_logs_lock = threading.Lock()
+        self.compaction_interval = float(os.getenv("VECTOR_COMPACTION_INTERVAL", "300"))
+        self.compaction_min_segments = int(os.getenv("VECTOR_COMPACTION_MIN_SEGMENTS", "4"))
+        self.compaction_segment_rows = int(os.getenv("VECTOR_COMPACTION_SEGMENT_ROWS", "10000"))
+        self.compaction_grace = float(os.getenv("VECTOR_COMPACTION_GRACE", "60"))
+        self._compactor: Optional[asyncio.Task] = None
+    
+    async def run_io(self, func, *args, **kwargs):
+        """Run blocking store work on the I/O thread pool.
+
+        Cancelling the awaiting task cancels the work if it has not started
+        yet; work already running finishes in its thread and is discarded.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._io_pool, functools.partial(func, *args, **kwargs))
+    
+    def shutdown_io_pool(self):
+        self._io_pool.shutdown(wait=False, cancel_futures=True)
     
     def _ensure_dir_exists(self):
         """Ensure the storage directory exists"""
@@ -51,59 +155,345 @@ class FileVectorStore:
     
     def _get_course_dir(self, course_id: str) -> str:
         """Get the directory for a specific course"""
-        # Look for directories that are course directories
-        for dir_name in os.listdir(self.storage_dir):
-            dir_path = os.path.join(self.storage_dir, dir_name)
-            if os.path.isdir(dir_path):
-                # Try to find a mapping file that maps this course name to the ID
-                mapping_file = os.path.join(dir_path, "course_info.json")
-                if os.path.exists(mapping_file):
-                    try:
-                        with open(mapping_file, 'r') as f:
-                            course_info = json.load(f)
-                            if course_info.get("id") == course_id:
-                                return dir_path
-                    except:
-                        pass
-                
-                # For backward compatibility, also check if directory starts with course ID
-                if dir_name.startswith(f"{course_id}_") or dir_name == course_id:
-                    return dir_path
+        course_dir = self.course_index.get(course_id)
+        if course_dir is not None:
+            return course_dir
+        
+        # If not indexed, return the course ID for backward compatibility; only writers create it
+        return os.path.join(self.storage_dir, course_id)
+    
+    def _load_course_matrix(self, course_id: str) -> CourseMatrix:
+        """Get the course matrix from the cache, building it from disk on first access"""
+        course_matrix = self.cache.get(course_id)
+        if course_matrix is not None:
+            return course_matrix
         
-        # If not found, return the course ID for backward compatibility
-        course_dir = os.path.join(self.storage_dir, course_id)
-        os.makedirs(course_dir, exist_ok=True)
-        return course_dir
+        # Concurrent searches of a cold course wait for one load instead of each reading it
+        with self._course_load_lock(course_id):
+            course_matrix = self.cache.peek(course_id)
+            if course_matrix is None:
+                course_matrix = self._read_course_matrix(course_id)
+                self.cache.put(course_id, course_matrix)
+        return course_matrix
+    
+    def _course_load_lock(self, course_id: str) -> threading.Lock:
+        """Lock held while a course matrix is read and cached.
+
+        Writers apply their cache update under it after publishing, so a load
+        that read the previous state either finished and gets updated, or
+        has not started reading yet and sees the write.
+        """
+        with self._load_locks_lock:
+            return self._load_locks.setdefault(course_id, threading.Lock())
+    
+    def _invalidate_all(self):
+        """Drop every cached matrix once loads in flight have finished, after storage changed underneath them"""
+        with self._load_locks_lock:
+            course_ids = list(self._load_locks)
+        for course_id in course_ids:
+            with self._course_load_lock(course_id):
+                self.cache.invalidate(course_id)
+        self.cache.clear()
+    
+    def _drop_course_indexes(self, course_id: str):
+        """Forget a course's resident search indexes along with its evicted matrix; they reload from disk"""
+        self.ann_indexes.pop(course_id, None)
+        self.lexical_indexes.pop(course_id, None)
+    
+    def _get_segment_log(self, course_dir: str) -> SegmentLog:
+        with self._segment_logs_lock:
+            log = self.segment_logs.get(course_dir)
+            if log is None:
+                log = SegmentLog(course_dir)
+                self.segment_logs[course_dir] = log
+            return log
+    
+    def _read_course_matrix(self, course_id: str) -> CourseMatrix:
+        """Build the course matrix from the current segment log snapshot"""
+        course_dir = self._get_course_dir(course_id)
+        if not os.path.isdir(course_dir):
+            return CourseMatrix.empty(self.quantization)
+        manifest, segments = self._get_segment_log(course_dir).snapshot()
+        course_matrix = CourseMatrix.from_segments(segments, self.quantization, manifest["tombstones"])
+        logger.info(f"Loaded {len(course_matrix)} vectors from {len(segments)} segments in course {course_id}")
+        return course_matrix
+    
+    def _get_ann_index(self, course_id: str) -> Optional[IVFIndex]:
+        """Get the course's IVF index, loading it from the course directory on first use"""
+        if course_id in self.ann_indexes:
+            return self.ann_indexes.get(course_id)
+        index_path = os.path.join(self._get_course_dir(course_id), ANN_INDEX_FILE)
+        index = IVFIndex.load(index_path)
+        self.ann_indexes[course_id] = index
+        return index
+    
+    def _save_ann_index(self, course_id: str, index: IVFIndex):
+        index.save(os.path.join(self._get_course_dir(course_id), ANN_INDEX_FILE))
+        self.ann_indexes[course_id] = index
+    
+    def _train_ann_index(self, course_id: str, course_matrix: CourseMatrix) -> IVFIndex:
+        index = IVFIndex.train(course_matrix.ids, course_matrix.document_ids, course_matrix.vectors())
+        self._save_ann_index(course_id, index)
+        logger.info(f"Trained ANN index with {index.n_lists} lists over {len(index)} vectors in course {course_id}")
+        return index
+    
+    def _update_ann_index(self, course_id: str, document_id: str):
+        """Add a stored document to the course's IVF index, training one once the course is large enough"""
+        if self.search_mode == "exact":
+            return
+        
+        with self._index_lock:
+            index = self._get_ann_index(course_id)
+            if index is None:
+                # The manifest knows the course size, so a small course is not loaded just to be counted
+                stats = self.get_course_stats(course_id, include_documents=False)
+                if stats is not None and stats["vectors"] >= self.ann_threshold:
+                    self._train_ann_index(course_id, self._load_course_matrix(course_id))
+                return
+            
+            course_matrix = self._load_course_matrix(course_id)
+            index = copy.copy(index)
+            rows = np.flatnonzero(course_matrix.document_ids == document_id)
+            index.add_document(document_id, course_matrix.ids[rows], course_matrix.vectors(rows))
+            if index.needs_retrain():
+                self._train_ann_index(course_id, course_matrix)
+            else:
+                self._save_ann_index(course_id, index)
+    
+    def _get_lexical_index(self, course_id: str) -> BM25Index:
+        """Get the course's BM25 index, building it from stored chunk text if it was never saved"""
+        index = self.lexical_indexes.get(course_id)
+        if index is None:
+            index_path = os.path.join(self._get_course_dir(course_id), LEXICAL_INDEX_FILE)
+            index = BM25Index.load(index_path)
+            if index is None:
+                index = BM25Index.empty()
+                course_matrix = self._load_course_matrix(course_id)
+                if len(course_matrix) > 0:
+                    payloads = course_matrix.payloads(np.arange(len(course_matrix)))
+                    index.add_chunks(
+                        list(course_matrix.ids),
+                        list(course_matrix.document_ids),
+                        [payload.get("content", "") for payload in payloads]
+                    )
+                    index.save(index_path)
+                    logger.info(f"Built lexical index over {len(index)} chunks in course {course_id}")
+            self.lexical_indexes[course_id] = index
+        return index
+    
+    def _get_course_centroids(self, course_id: str) -> Optional[CourseCentroids]:
+        """Get the course's routing centroids, building them from its vectors if missing; None for an empty course"""
+        centroids = self.course_centroids.get(course_id)
+        if centroids is not None:
+            return centroids
+        
+        with self._index_lock:
+            path = os.path.join(self._get_course_dir(course_id), ROUTING_FILE)
+            centroids = CourseCentroids.load(path)
+            if centroids is None:
+                course_matrix = self._load_course_matrix(course_id)
+                if len(course_matrix) == 0:
+                    return None
+                centroids = CourseCentroids.build(course_matrix.vectors(), self.routing_centroids)
+                centroids.save(path)
+            self.course_centroids[course_id] = centroids
+            return centroids
+    
+    def _invalidate_course_centroids(self, course_id: str):
+        """Forget routing centroids after vectors were added; deletions leave them a valid bound"""
+        with self._index_lock:
+            self.course_centroids.pop(course_id, None)
+            course_dir = self.course_index.get(course_id) or os.path.join(self.storage_dir, course_id)
+            path = os.path.join(course_dir, ROUTING_FILE)
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def _course_bounds(self, query: np.ndarray, course_ids: List[str]) -> List[tuple]:
+        """(best possible score, course id) for every course with vectors of the query's dimension, best first"""
+        bounds = []
+        for course_id in course_ids:
+            centroids = self._get_course_centroids(course_id)
+            if centroids is not None and centroids.dimension == query.shape[0]:
+                bounds.append((centroids.upper_bound(query), course_id))
+        return sorted(bounds, reverse=True)
+    
+    def _ann_candidates(self, course_id: str, course_matrix: CourseMatrix, query: np.ndarray,
+                        nprobe: Optional[int]) -> Optional[np.ndarray]:
+        """Rows in the probed IVF lists of a course, or None if there is no usable index"""
+        index = self._get_ann_index(course_id)
+        if index is None or index.centroids.shape[1] != course_matrix.dimension:
+            return None
+        
+        # Group the course rows by list once per matrix/index pair
+        lists = course_matrix.ann_lists
+        if lists is None or lists.version != index.version:
+            assignments = index.lookup(course_matrix.ids)
+            missing = np.flatnonzero(assignments < 0)
+            if missing.size:
+                assignments[missing] = index.assign(course_matrix.vectors(missing))
+            lists = InvertedLists(assignments, index.n_lists, index.version)
+            course_matrix.ann_lists = lists
+        
+        return candidate_rows(lists, index, query, nprobe or self.ann_nprobe)
+    
+    @staticmethod
+    def _restrict(rows: Optional[np.ndarray], ann_rows: Optional[np.ndarray], limit: int) -> Optional[np.ndarray]:
+        """Intersect filtered rows (None for all) with ANN candidates (None without an index)"""
+        if ann_rows is None:
+            return rows
+        if rows is None:
+            return ann_rows
+        restricted = np.intersect1d(rows, ann_rows, assume_unique=True)
+        # A narrow filter can miss the probed lists entirely; scan the filtered rows instead
+        return restricted if len(restricted) >= limit else rows
+    
+    def _get_shard_pool(self) -> Optional[ProcessPoolExecutor]:
+        if self._shard_pool is None and self.shard_workers > 0:
+            # Spawned workers don't inherit the event loop, threads or open database handles
+            self._shard_pool = ProcessPoolExecutor(
+                max_workers=self.shard_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._shard_pool
+    
+    def shutdown_shard_pool(self):
+        if self._shard_pool is not None:
+            self._shard_pool.shutdown(cancel_futures=True)
+            self._shard_pool = None
+    
+    def _sharded_rank(self, course_matrix: CourseMatrix, query: np.ndarray, rows: Optional[np.ndarray],
+                            limit: int, score_threshold: float):
+        """Exact top-k computed as partial top-k per worker shard and merged, or None if the course can't be sharded"""
+        pool = self._get_shard_pool()
+        if pool is None:
+            return None
+        
+        segment_vectors = [segment.vectors for segment in course_matrix.segments]
+        if rows is None:
+            # The plan over all rows only depends on the matrix, so it is kept with it
+            if course_matrix.shard_plan is None or course_matrix.shard_plan[0] != self.shard_workers:
+                course_matrix.shard_plan = (self.shard_workers, plan_shards(
+                    segment_vectors, course_matrix.segment_index, course_matrix.segment_rows,
+                    np.arange(len(course_matrix)), self.shard_workers
+                ))
+            shards = course_matrix.shard_plan[1]
+        else:
+            shards = plan_shards(
+                segment_vectors, course_matrix.segment_index, course_matrix.segment_rows, rows, self.shard_workers
+            )
+        if shards is None:
+            return None
+        if not shards:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        
+        try:
+            futures = [pool.submit(score_shard, pieces, query, limit) for pieces, _ in shards]
+            partials = [future.result() for future in futures]
+        except BrokenProcessPool as e:
+            # A worker died; start a fresh pool next time and scan in-process now
+            logger.error(f"Shard worker pool failed, falling back to an in-process scan: {e}")
+            self.shutdown_shard_pool()
+            return None
+        
+        candidates = np.concatenate([matrix_rows[positions] for (_, matrix_rows), (positions, _) in zip(shards, partials)])
+        scores = np.concatenate([partial_scores for _, partial_scores in partials])
+        # Merge in row order so ties break the same way as an in-process scan
+        order = np.argsort(candidates, kind='stable')
+        candidates, scores = candidates[order], scores[order]
+        selected = select_top_k(scores, limit, score_threshold)
+        return candidates[selected], scores[selected]
+    
+    def _rank(self, course_matrix: CourseMatrix, query: np.ndarray, rows: Optional[np.ndarray],
+              limit: int, score_threshold: float, rescore: bool, scores: Optional[np.ndarray] = None):
+        """Score rows (all rows when None), unless already scored, and return the selected rows with their scores"""
+        if scores is None:
+            scores = course_matrix.score(query, rows)
+        if rows is None:
+            rows = np.arange(len(course_matrix))
+        
+        if course_matrix.is_quantized and rescore and self.rescore_factor > 0:
+            # Shortlist on quantized scores, then rank the shortlist at full precision
+            shortlist = np.sort(rows[select_top_k(scores, limit * self.rescore_factor, -np.inf)])
+            exact_scores = course_matrix.exact_score(query, shortlist)
+            selected = select_top_k(exact_scores, limit, score_threshold)
+            return shortlist[selected], exact_scores[selected]
+        
+        selected = select_top_k(scores, limit, score_threshold)
+        return rows[selected], scores[selected]
+    
+    def _results(self, course_matrix: CourseMatrix, ranked: List[tuple]) -> List[List[Dict]]:
+        """Build result dicts for each (rows, scores) ranking, reading payloads once per distinct row"""
+        # Only the returned rows have their payloads read from disk
+        distinct = sorted({int(i) for indices, _ in ranked for i in indices})
+        payloads = dict(zip(distinct, course_matrix.payloads(distinct)))
+        return [
+            [
+                {
+                    "id": course_matrix.ids[i],
+                    "score": float(score),
+                    "payload": payloads[int(i)]
+                }
+                for i, score in zip(indices, scores)
+            ]
+            for indices, scores in ranked
+        ]
     
     def _get_document_path(self, course_id: str, document_id: str) -> str:
         """Get the file path for a specific document"""
-        return os.path.join(self._get_course_dir(course_id), f"{document_id}.json")
+        return os.path.join(self._get_course_dir(course_id), f"{document_id}{VECTORS_SUFFIX}")
     
     async def store_vectors(self, vectors: List[Dict[str, Any]], course_id: str, document_id: str, db_session: Optional[AsyncSession] = None) -> List[str]:
         """Store vectors for a document and return their IDs"""
+        # The course name comes from the database on the event loop; files are written on the I/O pool
+        course_name = await self._get_course_name(course_id, db_session)
+        return await self.run_io(self._store_vectors, vectors, course_id, document_id, course_name)
+    
+    def _store_vectors(self, vectors: List[Dict[str, Any]], course_id: str, document_id: str, course_name: str) -> List[str]:
         try:
             # Assign unique IDs to vectors
             for i, vector in enumerate(vectors):
                 if "id" not in vector:
                     vector["id"] = f"{document_id}_{i}"
             
-            # Get course name and create directory if needed
-            course_name = await self._get_course_name(course_id, db_session)
-            course_dir = os.path.join(self.storage_dir, course_name)
+            # Create the course directory if needed
+            if course_name == course_id:
+                # Without a resolvable name, keep writing to the course's existing directory
+                course_dir = self._get_course_dir(course_id)
+            else:
+                course_dir = os.path.join(self.storage_dir, course_name)
             os.makedirs(course_dir, exist_ok=True)
+            if self.course_index.get(course_id) != course_dir:
+                # The course moved to a new directory, so cached rows no longer match disk
+                with self._course_load_lock(course_id):
+                    self.cache.invalidate(course_id)
+                    self.course_index.set(course_id, os.path.basename(course_dir))
             
             # Create a mapping file to map course name to ID
-            mapping_file = os.path.join(course_dir, "course_info.json")
+            mapping_file = os.path.join(course_dir, COURSE_INFO_FILE)
             if not os.path.exists(mapping_file):
                 with open(mapping_file, 'w') as f:
                     json.dump({"id": course_id, "name": course_name}, f)
             
-            # Save vectors to file
-            file_path = os.path.join(course_dir, f"{document_id}.json")
-            with open(file_path, 'w') as f:
-                json.dump(vectors, f)
+            # Content-addressed embeddings are stored once; the segment only references them
+            keyed = [v for v in vectors if "content_key" in v]
+            keys = [v["content_key"] for v in keyed]
+            with self.content_store.hold(keys):
+                if keyed:
+                    added = self.content_store.put(keys, np.asarray([v["vector"] for v in keyed], dtype=np.float32))
+                    logger.info(f"Stored {added} new of {len(keyed)} content-addressed embeddings")
+                
+                # Append the vectors as a new segment; earlier rows of the document are tombstoned
+                name = self._get_segment_log(course_dir).append(vectors, document_id)
+            with self._course_load_lock(course_id):
+                if vectors:
+                    self.cache.update_document(course_id, load_segment(course_dir, name))
+                else:
+                    self.cache.remove_document(course_id, document_id)
+            if vectors:
+                self._invalidate_course_centroids(course_id)
+            self._update_ann_index(course_id, document_id)
             
-            logger.info(f"SUCCESS: Stored {len(vectors)} vectors for document {document_id} at {file_path}")
+            logger.info(f"SUCCESS: Stored {len(vectors)} vectors for document {document_id} in segment {name} of {course_dir}")
             return [v["id"] for v in vectors]
         except Exception as e:
             logger.error(f"ERROR in store_vectors: {str(e)}")
@@ -113,84 +503,273 @@ class FileVectorStore:
             logger.error(f"Storage dir writable: {os.access(self.storage_dir, os.W_OK)}")
             raise
     
-    async def search_similar(self, query_vector: List[float], course_id: str, limit: int = 10, 
-                       score_threshold: float = 0.7, db_session: Optional[AsyncSession] = None) -> List[Dict]:
-        """Search for similar vectors"""
+    def lookup_embeddings(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Embeddings already stored for content keys, from any course"""
+        return self.content_store.get(keys)
+    
+    @_on_io_pool
+    def search_similar(self, query_vector: List[float], course_id: str, limit: int = 10, 
+                       score_threshold: float = 0.7, db_session: Optional[AsyncSession] = None,
+                       search_mode: Optional[str] = None, nprobe: Optional[int] = None,
+                       rescore: Optional[bool] = None,
+                       filters: Optional[Dict[str, List[str]]] = None,
+                       mmr_lambda: Optional[float] = None, mmr_pool: Optional[int] = None) -> List[Dict]:
+        """Search for similar vectors, exactly or through the course's ANN index.
+
+        filters maps document_id, chunk_type or filename to the accepted values.
+        With mmr_lambda below 1 the best mmr_pool matches are re-ranked by
+        maximal marginal relevance, trading relevance for less redundancy.
+        """
         try:
-            course_dir = self._get_course_dir(course_id)
-            
-            if not os.path.exists(course_dir):
-                logger.warning(f"Course directory does not exist: {course_dir}")
+            course_matrix = self._load_course_matrix(course_id)
+            if len(course_matrix) == 0:
+                logger.warning(f"No vectors found for course {course_id}")
                 return []
                 
-            # Convert query vector to numpy for faster calculations
-            query_np = np.array(query_vector)
+            # Stored vectors are pre-normalized, so only the query needs scaling
+            query_np = normalize_query(query_vector)
+            if query_np is None:
+                return []
             
-            results = []
-            # Iterate through all document files in the course directory
-            files_found = 0
-            for file_name in os.listdir(course_dir):
-                if not file_name.endswith('.json') or file_name == "course_info.json":
-                    continue
-                    
-                files_found += 1
-                file_path = os.path.join(course_dir, file_name)
-                with open(file_path, 'r') as f:
-                    vectors = json.load(f)
-                
-                for vector in vectors:
-                    # Calculate cosine similarity
-                    vec_np = np.array(vector["vector"])
-                    similarity = np.dot(query_np, vec_np) / (np.linalg.norm(query_np) * np.linalg.norm(vec_np))
-                    
-                    if similarity >= score_threshold:
-                        results.append({
-                            "id": vector["id"],
-                            "score": float(similarity),
-                            "payload": vector["payload"]
-                        })
+            # Filters narrow the candidate rows before anything is scored
+            rows = course_matrix.filter_rows(filters)
+            if rows is not None and rows.size == 0:
+                return []
+            
+            search_mode = search_mode or self.search_mode
+            candidate_count = len(course_matrix) if rows is None else len(rows)
+            use_ann = search_mode == "ann" or (
+                search_mode == "auto" and candidate_count >= self.ann_threshold
+            )
+            
+            # Without an ANN index, score every candidate in one product
+            if use_ann:
+                if search_mode == "ann" and self._get_ann_index(course_id) is None:
+                    self._train_ann_index(course_id, course_matrix)
+                rows = self._restrict(rows, self._ann_candidates(course_id, course_matrix, query_np, nprobe), limit)
+            
+            # Diversification picks from a larger pool of the best matches
+            diversify = mmr_lambda is not None and mmr_lambda < 1.0
+            pool = max(limit, mmr_pool or 3 * limit) if diversify else limit
             
-            # Sort by score and limit results
-            results.sort(key=lambda x: x["score"], reverse=True)
-            logger.info(f"Found {len(results)} similar vectors from {files_found} files in course {course_id}")
-            return results[:limit]
+            ranked = None
+            if search_mode == "sharded":
+                ranked = self._sharded_rank(course_matrix, query_np, rows, pool, score_threshold)
+            if ranked is None:
+                ranked = self._rank(
+                    course_matrix, query_np, rows, pool, score_threshold,
+                    rescore=True if rescore is None else rescore
+                )
+            if diversify:
+                indices, scores = ranked
+                selected = mmr_select(scores, course_matrix.vectors(indices), limit, mmr_lambda)
+                ranked = (indices[selected], scores[selected])
+            results = self._results(course_matrix, [ranked])[0]
+            
+            logger.info(f"Found {len(results)} similar vectors among {len(course_matrix)} in course {course_id}")
+            return results
         except Exception as e:
             logger.error(f"ERROR in search_similar: {str(e)}")
             return []
     
-    async def delete_document(self, document_id: str, course_id: str, db_session: Optional[AsyncSession] = None) -> bool:
+    @_on_io_pool
+    def search_similar_many(self, query_vectors: List[List[float]], course_id: str, limit: int = 10,
+                                  score_threshold: float = 0.7, db_session: Optional[AsyncSession] = None,
+                                  search_mode: Optional[str] = None, nprobe: Optional[int] = None,
+                                  rescore: Optional[bool] = None,
+                                  filters: Optional[Dict[str, List[str]]] = None) -> List[List[Dict]]:
+        """Search for several query vectors at once, scoring them together in one matrix product"""
+        try:
+            if not query_vectors:
+                return []
+            course_matrix = self._load_course_matrix(course_id)
+            if len(course_matrix) == 0:
+                logger.warning(f"No vectors found for course {course_id}")
+                return [[] for _ in query_vectors]
+            
+            queries, valid = normalize_queries(query_vectors)
+            
+            # Filters narrow the candidate rows before anything is scored
+            rows = course_matrix.filter_rows(filters)
+            if rows is not None and rows.size == 0:
+                return [[] for _ in query_vectors]
+            
+            search_mode = search_mode or self.search_mode
+            candidate_count = len(course_matrix) if rows is None else len(rows)
+            use_ann = search_mode == "ann" or (
+                search_mode == "auto" and candidate_count >= self.ann_threshold
+            )
+            
+            # With an ANN index, score the union of the lists probed for every query
+            if use_ann and valid.any():
+                if search_mode == "ann" and self._get_ann_index(course_id) is None:
+                    self._train_ann_index(course_id, course_matrix)
+                probed = [self._ann_candidates(course_id, course_matrix, query, nprobe) for query in queries[valid]]
+                if all(candidates is not None for candidates in probed):
+                    rows = self._restrict(rows, np.unique(np.concatenate(probed)), limit)
+            
+            scores = course_matrix.score_many(queries[valid], rows) if valid.any() else None
+            # Zero queries have no scores row and match nothing
+            score_index = np.cumsum(valid) - 1
+            ranked = []
+            for q, query in enumerate(queries):
+                if not valid[q]:
+                    ranked.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+                    continue
+                ranked.append(self._rank(
+                    course_matrix, query, rows, limit, score_threshold,
+                    rescore=True if rescore is None else rescore,
+                    scores=scores[score_index[q]]
+                ))
+            results = self._results(course_matrix, ranked)
+            
+            logger.info(f"Searched {len(query_vectors)} queries among {len(course_matrix)} vectors in course {course_id}")
+            return results
+        except Exception as e:
+            logger.error(f"ERROR in search_similar_many: {str(e)}")
+            return [[] for _ in query_vectors]
+    
+    async def search_courses(self, query_vector: List[float], course_ids: List[str], limit: int = 10,
+                             score_threshold: float = 0.7, search_mode: Optional[str] = None,
+                             nprobe: Optional[int] = None,
+                             filters: Optional[Dict[str, List[str]]] = None) -> List[Dict]:
+        """Search several courses and merge their top-k lists, tagging each result with its course_id.
+
+        Courses are visited in order of the best score their centroids allow;
+        a course whose bound is below the threshold, or below the current
+        limit-th result, cannot change the merged list and is skipped.
+        """
+        try:
+            query_np = normalize_query(query_vector)
+            if query_np is None:
+                return []
+            course_ids = list(dict.fromkeys(course_ids))
+            bounds = await self.run_io(self._course_bounds, query_np, course_ids)
+            
+            merged: List[Dict] = []
+            searched = 0
+            for bound, course_id in bounds:
+                if bound < score_threshold or (len(merged) >= limit and merged[limit - 1]["score"] >= bound):
+                    break
+                results = await self.search_similar(
+                    query_vector, course_id, limit=limit, score_threshold=score_threshold,
+                    search_mode=search_mode, nprobe=nprobe, filters=filters
+                )
+                searched += 1
+                for result in results:
+                    result["course_id"] = course_id
+                merged = sorted(merged + results, key=lambda result: result["score"], reverse=True)[:limit]
+            
+            logger.info(f"Searched {searched} of {len(course_ids)} courses, found {len(merged)} results")
+            return merged
+        except Exception as e:
+            logger.error(f"ERROR in search_courses: {str(e)}")
+            return []
+    
+    @_on_io_pool
+    def index_text(self, course_id: str, document_id: str, chunk_ids: List[str], texts: List[str]) -> bool:
+        """Add a document's chunk text to the course's BM25 index, keyed by the chunks' vector ids"""
+        try:
+            with self._index_lock:
+                index = copy.copy(self._get_lexical_index(course_id))
+                index.add_document(document_id, chunk_ids, texts)
+                course_dir = self._get_course_dir(course_id)
+                os.makedirs(course_dir, exist_ok=True)
+                index.save(os.path.join(course_dir, LEXICAL_INDEX_FILE))
+                self.lexical_indexes[course_id] = index
+            logger.info(f"Indexed {len(chunk_ids)} chunks of document {document_id} for lexical search")
+            return True
+        except Exception as e:
+            logger.error(f"ERROR in index_text: {str(e)}")
+            return False
+    
+    @_on_io_pool
+    def search_lexical(self, query: str, course_id: str, limit: int = 10,
+                             db_session: Optional[AsyncSession] = None,
+                             filters: Optional[Dict[str, List[str]]] = None) -> List[Dict]:
+        """Search chunk text with BM25, touching only the postings of the query's terms"""
+        try:
+            index = self._get_lexical_index(course_id)
+            index_rows, scores = index.score(query)
+            if index_rows.size == 0:
+                return []
+            
+            # Chunks whose vectors were deleted or superseded are dropped here
+            course_matrix = self._load_course_matrix(course_id)
+            rows = course_matrix.rows_for_ids(index.chunk_ids[index_rows])
+            keep = rows >= 0
+            filter_rows = course_matrix.filter_rows(filters)
+            if filter_rows is not None:
+                keep &= np.isin(rows, filter_rows)
+            rows, scores = rows[keep], scores[keep]
+            
+            selected = select_top_k(scores, limit, -np.inf)
+            results = self._results(course_matrix, [(rows[selected], scores[selected])])[0]
+            logger.info(f"Found {len(results)} lexical matches in course {course_id}")
+            return results
+        except Exception as e:
+            logger.error(f"ERROR in search_lexical: {str(e)}")
+            return []
+    
+    def _forget_document(self, course_id: str, document_id: str):
+        """Drop a document from the resident matrix and the course's search indexes, after its rows were deleted"""
+        with self._course_load_lock(course_id):
+            self.cache.remove_document(course_id, document_id)
+        with self._index_lock:
+            index = self._get_ann_index(course_id)
+            if index is not None:
+                index = copy.copy(index)
+                index.remove_document(document_id)
+                self._save_ann_index(course_id, index)
+            
+            lexical_index = copy.copy(self._get_lexical_index(course_id))
+            if lexical_index.remove_document(document_id):
+                lexical_index.save(os.path.join(self._get_course_dir(course_id), LEXICAL_INDEX_FILE))
+                self.lexical_indexes[course_id] = lexical_index
+    
+    @_on_io_pool
+    def delete_document(self, document_id: str, course_id: str, db_session: Optional[AsyncSession] = None) -> bool:
         """Delete vectors for a document"""
         try:
             course_dir = self._get_course_dir(course_id)
-            file_path = os.path.join(course_dir, f"{document_id}.json")
+            if not os.path.isdir(course_dir):
+                logger.warning(f"No vectors found for course {course_id}")
+                return False
+            # Tombstone first, so a matrix loaded meanwhile is either fresh or fixed up by _forget_document
+            deleted = self._get_segment_log(course_dir).delete_document(document_id)
+            self._forget_document(course_id, document_id)
             
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                logger.info(f"Deleted vectors for document {document_id} at {file_path}")
+            if deleted:
+                logger.info(f"Deleted vectors for document {document_id} in {course_dir}")
                 return True
-            logger.warning(f"No vectors found at {file_path} for document {document_id}")
+            logger.warning(f"No vectors found in {course_dir} for document {document_id}")
             return False
         except Exception as e:
             logger.error(f"ERROR in delete_document: {str(e)}")
             return False
     
-    async def delete_course(self, course_id: str, db_session: Optional[AsyncSession] = None) -> bool:
+    @_on_io_pool
+    def delete_course(self, course_id: str, db_session: Optional[AsyncSession] = None) -> bool:
         """Delete all vectors for a course"""
         try:
-            course_dir = self._get_course_dir(course_id)
-            if os.path.exists(course_dir):
-                file_count = 0
-                for file_name in os.listdir(course_dir):
-                    if file_name.endswith('.json'):
-                        os.remove(os.path.join(course_dir, file_name))
-                        file_count += 1
+            self.ann_indexes.pop(course_id, None)
+            self.lexical_indexes.pop(course_id, None)
+            self.course_centroids.pop(course_id, None)
+            course_dir = self.course_index.get(course_id) or os.path.join(self.storage_dir, course_id)
+            exists = os.path.exists(course_dir)
+            if exists:
+                # Rename the directory away first so readers see either the whole course or none of it
+                trash_dir = os.path.join(self.storage_dir, f".deleted-{uuid.uuid4().hex}")
+                os.replace(course_dir, trash_dir)
+            with self._course_load_lock(course_id):
+                self.cache.invalidate(course_id)
+                self.course_index.remove(course_id)
+            if exists:
+                with self._segment_logs_lock:
+                    self.segment_logs.pop(course_dir, None)
                 
-                # Remove the directory itself
-                if file_count > 0:
-                    try:
-                        os.rmdir(course_dir)
-                    except:
-                        logger.warning(f"Could not remove course directory {course_dir}, it may not be empty")
+                file_count = len(os.listdir(trash_dir))
+                shutil.rmtree(trash_dir, ignore_errors=True)
                 
                 logger.info(f"Deleted {file_count} vector files for course {course_id}")
                 return True
@@ -211,8 +790,8 @@ class FileVectorStore:
             for dir_name in os.listdir(self.storage_dir):
                 dir_path = os.path.join(self.storage_dir, dir_name)
                 
-                # Skip if not a directory
-                if not os.path.isdir(dir_path):
+                # Skip if not a directory; dot directories hold shared content or deletions
+                if dir_name.startswith('.') or not os.path.isdir(dir_path):
                     continue
                 
                 # Skip if it's already a course name folder (has course_info.json)
@@ -253,12 +832,11 @@ class FileVectorStore:
                     # Move all files
                     files_moved = 0
                     for file_name in os.listdir(dir_path):
-                        if file_name.endswith('.json'):
+                        if file_name.endswith('.json') or is_store_file(file_name) or file_name == LEXICAL_INDEX_FILE:
                             old_file_path = os.path.join(dir_path, file_name)
                             new_file_path = os.path.join(new_dir_path, file_name)
                             # Copy instead of move to be safer
-                            with open(old_file_path, 'r') as src, open(new_file_path, 'w') as dst:
-                                dst.write(src.read())
+                            shutil.copyfile(old_file_path, new_file_path)
                             files_moved += 1
                     
                     logger.info(f"Migrated {files_moved} files from {dir_name} to {course_name}")
@@ -268,6 +846,14 @@ class FileVectorStore:
                     logger.error(f"Error migrating course {dir_name}: {e}")
                     errors += 1
             
+            # Course directories may have moved
+            self._invalidate_all()
+            self.ann_indexes.clear()
+            self.lexical_indexes.clear()
+            self.course_centroids.clear()
+            self.segment_logs.clear()
+            self.course_index.rebuild()
+            
             return {
                 "migrated": migrated,
                 "errors": errors,
@@ -278,7 +864,8 @@ class FileVectorStore:
             logger.error(f"Error in migrate_to_named_folders: {e}")
             return {"migrated": 0, "errors": 1, "error_message": str(e)}
 
-    async def reinitialize(self):
+    @_on_io_pool
+    def reinitialize(self):
         """Remove all embeddings and initialize a fresh storage"""
         try:
             # Count files for logging
@@ -299,8 +886,184 @@ class FileVectorStore:
                     # Remove directory
                     os.rmdir(dir_path)
             
+            self._invalidate_all()
+            self.ann_indexes.clear()
+            self.lexical_indexes.clear()
+            self.segment_logs.clear()
+            self.content_store.reset()
+            self.course_index.clear()
             logger.info(f"Reinitialized embeddings storage: removed {file_count} files from {dir_count} directories")
             return True
         except Exception as e:
             logger.error(f"Error reinitializing embeddings storage: {e}")
-            return False 
\ No newline at end of file
+            return False
+    
+    def get_course_stats(self, course_id: str, include_documents: bool = True) -> Optional[Dict[str, Any]]:
+        """Statistics of one course from its segment log manifest, or None for an unknown course"""
+        course_dir = self.course_index.get(course_id)
+        if course_dir is None:
+            return None
+        
+        stats = self._get_segment_log(course_dir).stats()
+        if not include_documents:
+            stats.pop("per_document")
+        stats["index_bytes"] = self._index_bytes(course_dir)
+        stats["directory"] = os.path.basename(course_dir)
+        return stats
+    
+    @staticmethod
+    def _index_bytes(course_dir: Optional[str]) -> int:
+        """Disk usage of the search indexes kept in a course directory"""
+        if course_dir is None:
+            return 0
+        return sum(
+            os.path.getsize(os.path.join(course_dir, file_name))
+            for file_name in (ANN_INDEX_FILE, LEXICAL_INDEX_FILE, ROUTING_FILE)
+            if os.path.exists(os.path.join(course_dir, file_name))
+        )
+    
+    def course_ids(self) -> List[str]:
+        """Ids of every course with stored vectors"""
+        return self.course_index.course_ids()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Statistics of every course plus totals, read from manifests without scanning vectors"""
+        courses = {}
+        for course_id in self.course_ids():
+            try:
+                stats = self.get_course_stats(course_id, include_documents=False)
+            except Exception as e:
+                logger.error(f"Error reading stats for course {course_id}: {e}")
+                continue
+            if stats is not None:
+                courses[course_id] = stats
+        
+        return {
+            "courses": courses,
+            "course_count": len(courses),
+            "vectors": sum(c["vectors"] for c in courses.values()),
+            "documents": sum(c["documents"] for c in courses.values()),
+            "bytes": sum(c["bytes"] + c["index_bytes"] for c in courses.values()) + self.content_store.nbytes,
+            "content": {"embeddings": len(self.content_store), "bytes": self.content_store.nbytes},
+            "last_modified": max((c["last_modified"] for c in courses.values() if c["last_modified"]), default=None),
+            "resident": self.cache.stats()
+        }
+    
+    def warm_up(self, course_ids: List[str], memory_budget: int) -> Dict[str, Any]:
+        """Load the search indexes of courses, in priority order, while their matrices fit in memory_budget bytes.
+
+        Sizes are estimated from the manifests before anything is read, so a
+        course that would not fit is skipped without loading it.
+        """
+        if self.cache.max_bytes > 0:
+            # Loading past the cache budget would only evict what was just warmed
+            memory_budget = min(memory_budget, self.cache.max_bytes)
+        loaded, skipped = [], []
+        used = self.cache.stats()["bytes"]
+        for course_id in course_ids:
+            if self.cache.peek(course_id) is not None:
+                continue
+            stats = self.get_course_stats(course_id, include_documents=False)
+            if stats is None or stats["vectors"] == 0:
+                continue
+            estimate = stats["vectors"] * resident_row_bytes(max(stats["dimensions"], default=0), self.quantization)
+            if used + estimate > memory_budget:
+                # A smaller, less active course may still fit
+                skipped.append(course_id)
+                continue
+            try:
+                course_matrix = self._load_course_matrix(course_id)
+                self._get_lexical_index(course_id)
+                if self.search_mode != "exact":
+                    self._get_ann_index(course_id)
+            except Exception as e:
+                logger.error(f"Error warming up course {course_id}: {e}")
+                continue
+            used += course_matrix.nbytes
+            loaded.append(course_id)
+        
+        logger.info(f"Warmed up {len(loaded)} courses ({used} resident bytes), skipped {len(skipped)} over budget")
+        return {"loaded": loaded, "skipped": skipped, "resident_bytes": used}
+    
+    def compact_course(self, course_id: str) -> bool:
+        """Merge a course's small or partly deleted segments and purge expired retired ones"""
+        course_dir = self.course_index.get(course_id)
+        if course_dir is None:
+            return False
+        
+        log = self._get_segment_log(course_dir)
+        log.purge_retired(self.compaction_grace)
+        if not log.compact(self.compaction_min_segments, self.compaction_segment_rows):
+            return False
+        
+        # A matrix cached before the merge, or loaded from the old manifest while it ran, still reads
+        # the retired segments; point it at the merged one before they are purged
+        with self._course_load_lock(course_id):
+            cached = self.cache.peek(course_id)
+            if cached is not None:
+                live = {entry["name"] for entry in log.read_manifest()["segments"]}
+                referenced = {cached.segments[i].name for i in np.unique(cached.segment_index)}
+                if not referenced <= live:
+                    self.cache.invalidate(course_id)
+                    self.cache.put(course_id, self._read_course_matrix(course_id))
+        return True
+    
+    def collect_content(self) -> bool:
+        """Drop shared embeddings no course segment references any more and merge small content packs"""
+        def course_dirs():
+            return sorted(
+                entry.path for entry in os.scandir(self.storage_dir)
+                if entry.is_dir() and not entry.name.startswith(".")
+            )
+        
+        scanned = course_dirs()
+        live_keys = set()
+        for course_dir in scanned:
+            live_keys.update(segment_content_keys(course_dir))
+        if course_dirs() != scanned:
+            # A course directory moved while it was scanned, so references may be missing
+            return False
+        
+        if not self.content_store.collect(live_keys, self.compaction_grace, self.compaction_segment_rows):
+            return False
+        # Cached matrices and shard workers read the replaced packs, which are purged after the grace period
+        self._invalidate_all()
+        return True
+    
+    def compact_all(self) -> int:
+        """Run one compaction pass over every indexed course, then over the shared content packs"""
+        compacted = 0
+        for course_id in self.course_ids():
+            try:
+                if self.compact_course(course_id):
+                    compacted += 1
+            except Exception as e:
+                logger.error(f"Error compacting course {course_id}: {e}")
+        try:
+            self.collect_content()
+        except Exception as e:
+            logger.error(f"Error collecting content packs: {e}")
+        return compacted
+    
+    async def _run_compactor(self):
+        while True:
+            await asyncio.sleep(self.compaction_interval)
+            compacted = await self.run_io(self.compact_all)
+            if compacted:
+                logger.info(f"Compacted segments of {compacted} courses")
+    
+    def start_compactor(self):
+        """Start periodic background compaction, unless VECTOR_COMPACTION_INTERVAL is 0"""
+        if self.compaction_interval <= 0 or self._compactor is not None:
+            return
+        self._compactor = asyncio.create_task(self._run_compactor())
+    
+    async def stop_compactor(self):
+        if self._compactor is None:
+            return
+        self._compactor.cancel()
+        try:
+            await self._compactor
+        except asyncio.CancelledError:
+            pass
+        self._compactor = None
@@ -36,16 +36,19 @@ class IngestionService:
                 
                 # Extract text (only PDF for now)
                 text = ""
+                pages = []
                 if filename.lower().endswith('.pdf'):
                     try:
                         with pdfplumber.open(file_path) as pdf:
-                            for page in pdf.pages:
+                            for page_number, page in enumerate(pdf.pages, start=1):
                                 page_text = page.extract_text()
                                 if page_text:
+                                    pages.append((page_number, page_text))
                                     text += page_text + "\n\n"
                     except Exception as e:
                         logger.error(f"PDF extraction error: {e}")
                         text = ""
+                        pages = []
                 
                 if not text or len(text.strip()) < 10:
                     document.status = "failed"
@@ -55,18 +58,24 @@ class IngestionService:
                 
                 document.raw_text = text
                 
-                # Simple chunking
-                chunks = self.simple_chunk(text, chunk_size=1000, overlap=200)
+                # Chunk each page on its own so editing one page leaves the other pages' chunks,
+                # and so their cached embeddings, unchanged on re-upload
+                page_chunks = [
+                    (page_number, chunk_text)
+                    for page_number, page_text in pages
+                    for chunk_text in self.simple_chunk(page_text, chunk_size=1000, overlap=200)
+                ]
+                chunks = [chunk_text for _, chunk_text in page_chunks]
                 
                 # Store chunks
                 chunk_records = []
-                for i, chunk_text in enumerate(chunks):
+                for i, (page_number, chunk_text) in enumerate(page_chunks):
                     chunk_record = DocumentChunk(
                         document_id=document.id,
                         course_id=course_id,
                         content=chunk_text,
                         chunk_index=i,
-                        chunk_metadata={"filename": filename},
+                        chunk_metadata={"filename": filename, "page": page_number},
                         chunk_type="semantic"
                     )
                     session.add(chunk_record)
@@ -75,7 +84,10 @@ class IngestionService:
                 await session.flush()
                 
                 # Store embeddings
-                chunk_dicts = [{"content": c, "metadata": {"filename": filename}} for c in chunks]
+                chunk_dicts = [
+                    {"id": str(record.id), "content": record.content, "metadata": record.chunk_metadata}
+                    for record in chunk_records
+                ]
                 vector_ids = await self.embedding_service.store_embeddings(
                     chunk_dicts, 
                     course_id, 
@@ -89,6 +101,9 @@ class IngestionService:
 
                 await session.flush()
                 
+                # Index chunk text for lexical search on exact identifiers
+                await self.embedding_service.index_text(course_id, str(document.id), vector_ids, chunks)
+                
                 # Update document status
                 document.status = "completed"
                 document.chunk_count = len(chunks)
@@ -0,0 +1,256 @@
+import os
+import re
+import logging
+import numpy as np
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_FILE = "bm25_index.npz"
+
+# Reciprocal-rank fusion constant; larger values flatten the advantage of top ranks
+RRF_K = 60
+
+# Identifiers such as "cat-797f", "mntc413" or "eq.3.2" are kept whole and also split into parts
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-_/][a-z0-9]+)*")
+PART_PATTERN = re.compile(r"[a-z]+|[0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms of a text, with compound identifiers also split into their parts"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        parts = PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part not in STOPWORDS)
+    return tokens
+
+
+def _pack_strings(values) -> Tuple[np.ndarray, np.ndarray]:
+    """Encode strings as one UTF-8 byte buffer plus int64 end offsets"""
+    encoded = [str(value).encode('utf-8') for value in values]
+    ends = np.cumsum([len(e) for e in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), ends
+
+
+def _unpack_strings(buffer: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    data = buffer.tobytes()
+    starts = np.concatenate([[0], ends[:-1]]) if len(ends) else ends
+    values = np.empty(len(ends), dtype=object)
+    values[:] = [data[s:e].decode('utf-8') for s, e in zip(starts, ends)]
+    return values
+
+
+class BM25Index:
+    """BM25 inverted index over the chunks of one course.
+
+    Postings are held in CSR form: the postings of term t are rows
+    rows[offsets[t]:offsets[t + 1]] with term frequencies tfs[...], so a
+    query only touches the postings of its own terms. Rows are chunks,
+    identified by the vector id of the chunk's embedding.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(
+        self,
+        terms: np.ndarray,
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        tfs: np.ndarray,
+        lengths: np.ndarray,
+        chunk_ids: np.ndarray,
+        document_ids: np.ndarray
+    ):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.lengths = lengths
+        self.chunk_ids = chunk_ids
+        self.document_ids = document_ids
+        self._term_ids = {term: i for i, term in enumerate(terms)}
+        self.average_length = max(float(lengths.mean()), 1.0) if len(lengths) else 1.0
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @classmethod
+    def empty(cls) -> "BM25Index":
+        return cls(
+            np.empty(0, dtype=object),
+            np.zeros(1, dtype=np.int64),
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.uint16),
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=object),
+            np.empty(0, dtype=object)
+        )
+
+    def _postings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """All postings as (term id, row, tf) triples"""
+        term_of = np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(self.offsets))
+        return term_of, self.rows.astype(np.int64), self.tfs
+
+    def _rebuild(
+        self,
+        terms: np.ndarray,
+        term_of: np.ndarray,
+        rows: np.ndarray,
+        tfs: np.ndarray,
+        lengths: np.ndarray,
+        chunk_ids: np.ndarray,
+        document_ids: np.ndarray
+    ):
+        """Replace the postings with (term id, row, tf) triples, dropping terms left without postings"""
+        order = np.lexsort((rows, term_of))
+        term_of, rows, tfs = term_of[order], rows[order], tfs[order]
+
+        used, term_of = np.unique(term_of, return_inverse=True)
+        self.terms = terms[used]
+        self.offsets = np.searchsorted(term_of, np.arange(len(used) + 1)).astype(np.int64)
+        self.rows = rows.astype(np.int32)
+        self.tfs = tfs.astype(np.uint16)
+        self.lengths = lengths.astype(np.int32)
+        self.chunk_ids = chunk_ids
+        self.document_ids = document_ids
+        self._term_ids = {term: i for i, term in enumerate(self.terms)}
+        self.average_length = max(float(self.lengths.mean()), 1.0) if len(self.lengths) else 1.0
+
+    def remove_document(self, document_id: str) -> bool:
+        """Drop every chunk of a document"""
+        keep_rows = self.document_ids != document_id
+        if keep_rows.all():
+            return False
+        term_of, rows, tfs = self._postings()
+        keep = keep_rows[rows]
+        renumber = np.cumsum(keep_rows) - 1
+        self._rebuild(
+            self.terms, term_of[keep], renumber[rows[keep]], tfs[keep],
+            self.lengths[keep_rows], self.chunk_ids[keep_rows], self.document_ids[keep_rows]
+        )
+        return True
+
+    def add_document(self, document_id: str, chunk_ids: List[str], texts: List[str]):
+        """Index a document's chunks, replacing any earlier chunks of the same document"""
+        self.remove_document(document_id)
+        self.add_chunks(chunk_ids, [document_id] * len(chunk_ids), texts)
+
+    def add_chunks(self, chunk_ids: List[str], document_ids: List[str], texts: List[str]):
+        """Append chunks to the index in one rebuild of the postings"""
+        if not chunk_ids:
+            return
+
+        counts = [Counter(tokenize(text)) for text in texts]
+        new_terms = sorted({term for c in counts for term in c} - set(self._term_ids))
+        terms = np.empty(len(self.terms) + len(new_terms), dtype=object)
+        terms[:] = sorted(list(self.terms) + new_terms)
+        term_ids = {term: i for i, term in enumerate(terms)}
+
+        term_of, rows, tfs = self._postings()
+        # Existing term ids shift to their place in the merged vocabulary
+        remap = np.array([term_ids[term] for term in self.terms], dtype=np.int64)
+        term_of = remap[term_of] if len(remap) else term_of
+
+        base = len(self.chunk_ids)
+        new_term_of = [term_ids[term] for c in counts for term in c]
+        new_rows = [base + i for i, c in enumerate(counts) for _ in c]
+        new_tfs = [min(tf, np.iinfo(np.uint16).max) for c in counts for tf in c.values()]
+
+        added_ids = np.empty(len(chunk_ids), dtype=object)
+        added_ids[:] = list(chunk_ids)
+        added_documents = np.empty(len(chunk_ids), dtype=object)
+        added_documents[:] = list(document_ids)
+        self._rebuild(
+            terms,
+            np.concatenate([term_of, np.asarray(new_term_of, dtype=np.int64)]),
+            np.concatenate([rows, np.asarray(new_rows, dtype=np.int64)]),
+            np.concatenate([tfs, np.asarray(new_tfs, dtype=np.uint16)]),
+            np.concatenate([self.lengths, np.asarray([sum(c.values()) for c in counts], dtype=np.int32)]),
+            np.concatenate([self.chunk_ids, added_ids]),
+            np.concatenate([self.document_ids, added_documents])
+        )
+
+    def score(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 scores of every chunk containing a query term, as (rows, scores)"""
+        term_ids = [self._term_ids[t] for t in set(tokenize(query)) if t in self._term_ids]
+        if not term_ids or len(self) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        n = len(self)
+        hit_rows = []
+        contributions = []
+        for t in term_ids:
+            rows = self.rows[self.offsets[t]:self.offsets[t + 1]]
+            tfs = self.tfs[self.offsets[t]:self.offsets[t + 1]].astype(np.float32)
+            idf = np.log(1.0 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.K1 * (1.0 - self.B + self.B * self.lengths[rows] / self.average_length)
+            hit_rows.append(rows)
+            contributions.append(idf * tfs * (self.K1 + 1.0) / (tfs + norm))
+
+        rows, inverse = np.unique(np.concatenate(hit_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions)).astype(np.float32)
+        return rows.astype(np.int64), scores
+
+    def save(self, path: str):
+        terms, term_ends = _pack_strings(self.terms)
+        chunk_ids, chunk_id_ends = _pack_strings(self.chunk_ids)
+        document_ids, document_id_ends = _pack_strings(self.document_ids)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                terms=terms,
+                term_ends=term_ends,
+                offsets=self.offsets,
+                rows=self.rows,
+                tfs=self.tfs,
+                lengths=self.lengths,
+                chunk_ids=chunk_ids,
+                chunk_id_ends=chunk_id_ends,
+                document_ids=document_ids,
+                document_id_ends=document_id_ends
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                return cls(
+                    _unpack_strings(data["terms"], data["term_ends"]),
+                    data["offsets"],
+                    data["rows"],
+                    data["tfs"],
+                    data["lengths"],
+                    _unpack_strings(data["chunk_ids"], data["chunk_id_ends"]),
+                    _unpack_strings(data["document_ids"], data["document_id_ends"])
+                )
+        except Exception as e:
+            logger.warning(f"Could not load lexical index {path}: {e}")
+            return None
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[Dict]], limit: int, k: int = RRF_K) -> List[Dict]:
+    """Fuse ranked result lists by summing 1 / (k + rank), keeping each list's own score as <name>_score"""
+    fused: Dict[str, Dict] = {}
+    for name, results in rankings.items():
+        for rank, result in enumerate(results, start=1):
+            entry = fused.get(result["id"])
+            if entry is None:
+                entry = {key: value for key, value in result.items() if key != "score"}
+                entry["score"] = 0.0
+                fused[result["id"]] = entry
+            entry["score"] += 1.0 / (k + rank)
+            entry[f"{name}_score"] = result["score"]
+    return sorted(fused.values(), key=lambda entry: entry["score"], reverse=True)[:limit]
@@ -0,0 +1,138 @@
+import asyncio
+import random
+import logging
+from typing import List, Dict, Any, Optional
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Embedding request limits of the OpenAI API
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300000
+
+# Status codes worth retrying besides connection errors and timeouts
+RETRY_STATUS = {408, 409, 429}
+
+
+def estimate_tokens(text: str) -> int:
+    """Generous token count of a text without a tokenizer; English averages about 4 bytes per token"""
+    return len(text.encode('utf-8')) // 3 + 1
+
+
+def plan_batches(texts: List[str], max_tokens: int, max_inputs: int) -> List[range]:
+    """Split texts, in order, into runs within both the estimated token and the input count limits"""
+    batches = []
+    start, tokens = 0, 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if i > start and (tokens + cost > max_tokens or i - start >= max_inputs):
+            batches.append(range(start, i))
+            start, tokens = i, 0
+        tokens += cost
+    if start < len(texts):
+        batches.append(range(start, len(texts)))
+    return batches
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked to wait before retrying, if it said"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            # An HTTP date; fall back to our own backoff
+            return None
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code in RETRY_STATUS or error.status_code >= 500)
+
+
+class OpenAIEmbeddingBatcher:
+    """Embeds many texts through the OpenAI API in token-sized batches sent concurrently.
+
+    Batches are sized by estimated tokens and input count, at most
+    max_concurrency are in flight, and throttled or failed requests are
+    retried with jittered exponential backoff, waiting at least as long as
+    a Retry-After header asks.
+    """
+
+    def __init__(self, client, model: str, max_tokens: int = 100000, max_inputs: int = 512,
+                 max_concurrency: int = 4, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 30.0):
+        self.client = client
+        self.model = model
+        self.max_tokens = min(max_tokens, MAX_TOKENS_PER_REQUEST)
+        self.max_inputs = min(max_inputs, MAX_INPUTS_PER_REQUEST)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._slots = asyncio.Semaphore(max(1, max_concurrency))
+        self.requests = 0
+        self.retries = 0
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        """Full-jitter exponential delay, raised to the server's Retry-After if that is longer"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        requested = retry_after(error)
+        return max(delay, requested) if requested is not None else delay
+
+    async def _embed_batch(self, batch: List[str], number: int) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                async with self._slots:
+                    self.requests += 1
+                    response = await self.client.embeddings.create(model=self.model, input=batch)
+                break
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = self.backoff(attempt, e)
+                attempt += 1
+                self.retries += 1
+                logger.warning(f"OpenAI embedding batch {number} failed ({e}); retry {attempt} in {delay:.2f}s")
+                # Sleep outside the semaphore so other batches keep going
+                await asyncio.sleep(delay)
+
+        if not response or not response.data:
+            raise ValueError(f"OpenAI API returned empty response for batch {number}")
+        if len(response.data) != len(batch):
+            raise ValueError(f"OpenAI API returned {len(response.data)} embeddings for {len(batch)} texts")
+
+        embeddings = []
+        for item in sorted(response.data, key=lambda item: item.index):
+            if not item or not item.embedding:
+                raise ValueError("OpenAI API returned empty embedding in batch")
+            embeddings.append(item.embedding)
+        return embeddings
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embeddings of texts, in order"""
+        batches = plan_batches(texts, self.max_tokens, self.max_inputs)
+        tasks = [
+            asyncio.create_task(self._embed_batch([texts[i] for i in batch], number))
+            for number, batch in enumerate(batches, start=1)
+        ]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # One batch gave up; the rest would only be thrown away
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return [embedding for batch in results for embedding in batch]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "retries": self.retries}
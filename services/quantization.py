@@ -0,0 +1,90 @@
+import numpy as np
+from typing import Optional, Tuple
+
+# Storage modes for resident course matrices
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+# Quantized rows are widened to float32 in blocks to bound temporary memory
+SCORE_BLOCK_ROWS = 16384
+
+
+def quantize_rows(matrix: np.ndarray, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray], Optional[np.ndarray]]:
+    """Quantize a float32 matrix, returning (codes, scales, offsets).
+
+    int8 rows are stored as codes with a per-row scale and offset so that
+    row ~= codes * scale + offset; the other modes return no scales/offsets.
+    """
+    if mode == "float16":
+        return matrix.astype(np.float16), None, None
+    if mode != "int8":
+        return np.ascontiguousarray(matrix, dtype=np.float32), None, None
+
+    if matrix.size == 0:
+        empty = np.zeros(matrix.shape[0], dtype=np.float32)
+        return matrix.astype(np.int8), empty, empty.copy()
+
+    low = matrix.min(axis=1)
+    high = matrix.max(axis=1)
+    scales = (high - low) / 255.0
+    # Constant rows quantize to a single code
+    scales[scales == 0] = 1.0
+    codes = np.rint((matrix - low[:, None]) / scales[:, None]) - 128
+    codes = np.clip(codes, -128, 127).astype(np.int8)
+    offsets = low + 128.0 * scales
+    return codes, scales.astype(np.float32), offsets.astype(np.float32)
+
+
+def resident_row_bytes(dimension: int, mode: str) -> int:
+    """Bytes one row of a resident matrix takes in the given mode"""
+    if mode == "float16":
+        return 2 * dimension
+    if mode == "int8":
+        # Codes plus a float32 scale and offset
+        return dimension + 8
+    return 4 * dimension
+
+
+def dequantize_rows(
+    codes: np.ndarray,
+    scales: Optional[np.ndarray] = None,
+    offsets: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Approximate float32 rows from quantized codes"""
+    rows = codes.astype(np.float32)
+    if scales is not None:
+        rows = rows * scales[:, None] + offsets[:, None]
+    return rows
+
+
+def score_rows(
+    codes: np.ndarray,
+    query: np.ndarray,
+    scales: Optional[np.ndarray] = None,
+    offsets: Optional[np.ndarray] = None,
+    rows: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Inner products of a float32 query (or a queries x dim matrix) with (a subset of) quantized rows.
+
+    Returns one score per row, or a rows x queries matrix for several queries.
+    For int8 rows, codes . q is corrected with the per-row scale and offset:
+    (codes * s + o) . q = s * (codes . q) + o * sum(q).
+    """
+    if codes.dtype == np.float32 and scales is None:
+        return codes @ query.T if rows is None else codes[rows] @ query.T
+
+    count = codes.shape[0] if rows is None else len(rows)
+    scores = np.empty((count,) + query.shape[:-1], dtype=np.float32)
+    query_sum = query.sum(axis=-1)
+    # Per-row corrections broadcast across the query columns
+    row_shape = (-1,) + (1,) * (query.ndim - 1)
+    for start in range(0, count, SCORE_BLOCK_ROWS):
+        end = min(start + SCORE_BLOCK_ROWS, count)
+        selection = slice(start, end) if rows is None else rows[start:end]
+        block_scores = codes[selection].astype(np.float32) @ query.T
+        if scales is not None:
+            block_scores = (
+                block_scores * scales[selection].reshape(row_shape)
+                + offsets[selection].reshape(row_shape) * query_sum
+            )
+        scores[start:end] = block_scores
+    return scores
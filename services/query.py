@@ -1,6 +1,7 @@
 from typing import List, Dict, Optional
 import asyncio
 import logging
+import os
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from models.database import Course, ChatSession, ChatMessage, DocumentChunk
@@ -12,6 +13,10 @@ logger = logging.getLogger(__name__)
 class QueryService:
     def __init__(self):
         self.embedding_service = None
+        # Maximal marginal relevance over retrieved chunks: 1.0 keeps pure relevance order,
+        # lower values drop more near-duplicates from overlapping chunks
+        self.mmr_lambda = float(os.getenv("QUERY_MMR_LAMBDA", "1.0"))
+        self.mmr_pool = int(os.getenv("QUERY_MMR_POOL", "24"))
         
     async def initialize(self, embedding_service: EmbeddingService):
         """Initialize with embedding service"""
@@ -24,17 +29,21 @@ class QueryService:
         session_id: Optional[str] = None,
         chat_history: Optional[List[Dict]] = None,
         course_name: str = "your course",
-        db_session: Optional[AsyncSession] = None
+        db_session: Optional[AsyncSession] = None,
+        mmr_lambda: Optional[float] = None,
+        mmr_pool: Optional[int] = None
     ) -> Dict:
         """Process a user query and return response with sources"""
         try:
-            # Find relevant chunks using vector search
+            # Find relevant chunks using vector search, re-ranked to avoid near-duplicate chunks
             relevant_chunks = await self.embedding_service.search_similar(
                 query=query,
                 course_id=course_id,
                 limit=8,
                 score_threshold=0.6,
-                db_session=db_session
+                db_session=db_session,
+                mmr_lambda=self.mmr_lambda if mmr_lambda is None else mmr_lambda,
+                mmr_pool=mmr_pool or self.mmr_pool
             )
             
             if not relevant_chunks:
@@ -0,0 +1,143 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query_text(text: str) -> str:
+    """Collapse whitespace, Unicode forms and case so trivially different phrasings share an entry"""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+class QueryEmbeddingCache:
+    """Query embeddings keyed by model and normalized text, in an in-memory LRU over an optional SQLite file.
+
+    The SQLite tier survives restarts; entries read from it are promoted to
+    memory. Disk reads and writes run in the default executor.
+    """
+
+    def __init__(self, max_entries: int = 1024, path: Optional[str] = None, max_disk_entries: int = 100000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._disk_writes = 0
+        if path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS query_embeddings "
+                    "(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS query_embeddings_last_used ON query_embeddings (last_used)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Could not open query embedding cache {path}, keeping it in memory only: {e}")
+                self._db = None
+
+    @staticmethod
+    def key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\0{normalize_query_text(text)}".encode('utf-8')).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[np.ndarray]:
+        with self._db_lock:
+            row = self._db.execute("SELECT vector FROM query_embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE query_embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def _write_disk(self, key: str, vector: np.ndarray):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                (key, vector.tobytes(), time.time())
+            )
+            self._disk_writes += 1
+            # Trim the least recently used entries now and then rather than on every write
+            if self._disk_writes % 1000 == 0:
+                self._db.execute(
+                    "DELETE FROM query_embeddings WHERE key IN "
+                    "(SELECT key FROM query_embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+            self._db.commit()
+
+    async def get(self, key: str) -> Optional[np.ndarray]:
+        """Cached embedding for a key, from memory or else from disk, or None"""
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+
+        if self._db is not None:
+            try:
+                vector = await asyncio.get_running_loop().run_in_executor(None, self._read_disk, key)
+            except sqlite3.Error as e:
+                logger.error(f"Error reading query embedding cache: {e}")
+                vector = None
+            if vector is not None:
+                self._remember(key, vector)
+                with self._lock:
+                    self.disk_hits += 1
+                return vector
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def put(self, key: str, vector) -> np.ndarray:
+        """Cache an embedding in memory and, if enabled, on disk"""
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, vector)
+        if self._db is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write_disk, key, vector)
+            except sqlite3.Error as e:
+                logger.error(f"Error writing query embedding cache: {e}")
+        return vector
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "persistent": self._db is not None,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else None
+            }
@@ -0,0 +1,320 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+from .vector_segments import (
+    MANIFEST_FILE, SEGMENT_SUFFIXES, Segment, atomic_write_json, delete_segment,
+    list_segments, load_segment, write_segment
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SegmentLog:
+    """Append-only log of immutable segments for one course directory.
+
+    segments.json is the only mutable file. It lists the live segments in
+    order, a tombstone set per segment (documents whose rows in that segment
+    are dead because the document was deleted or re-stored later) and the
+    segments retired by compaction. Writers create new segment files and then
+    publish a new manifest with an atomic rename, so a reader that loads the
+    manifest once sees a consistent snapshot without taking any lock.
+
+    The manifest also carries running statistics (rows, dimension and bytes
+    per segment; live vectors per document) so they never need a scan.
+    """
+
+    def __init__(self, course_dir: str):
+        self.course_dir = course_dir
+        self.manifest_path = os.path.join(course_dir, MANIFEST_FILE)
+        # Serializes writers (store, delete, compaction); readers never take it
+        self._lock = threading.Lock()
+
+    def read_manifest(self) -> Dict[str, Any]:
+        """Load the manifest, or describe a course directory from before the segment log"""
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+
+        # Adopt per-document files as one-document segments named after the document
+        return {
+            "version": 0,
+            "next_segment": 1,
+            "segments": [
+                {"name": name, "rows": None, "documents": [name]}
+                for name in list_segments(self.course_dir)
+            ],
+            "tombstones": {},
+            "retired": [],
+            # Statistics are backfilled by stats() for adopted directories
+            "documents": None
+        }
+
+    def _publish(self, manifest: Dict[str, Any]):
+        manifest["version"] += 1
+        manifest["updated_at"] = time.time()
+        atomic_write_json(self.manifest_path, manifest)
+
+    def _segment_entry(self, name: str, rows: int, dimension: int, documents: List[str]) -> Dict[str, Any]:
+        """Manifest entry for a segment that was just written"""
+        return {
+            "name": name,
+            "rows": rows,
+            "documents": documents,
+            "dimension": dimension,
+            "bytes": self._segment_bytes(name),
+            "created_at": time.time()
+        }
+
+    def _segment_bytes(self, name: str) -> int:
+        total = 0
+        for suffix in SEGMENT_SUFFIXES:
+            path = os.path.join(self.course_dir, f"{name}{suffix}")
+            if os.path.exists(path):
+                total += os.path.getsize(path)
+        return total
+
+    def snapshot(self) -> Tuple[Dict[str, Any], List[Segment]]:
+        """Read one manifest version and load the segments it lists"""
+        for _ in range(3):
+            manifest = self.read_manifest()
+            segments = []
+            for entry in manifest["segments"]:
+                segment = load_segment(self.course_dir, entry["name"])
+                if segment is None:
+                    # Retired and purged since the manifest was read; take a newer snapshot
+                    break
+                segments.append(segment)
+            else:
+                return manifest, segments
+        raise RuntimeError(f"Could not read a consistent snapshot of {self.course_dir}")
+
+    @staticmethod
+    def _tombstone(manifest: Dict[str, Any], document_id: str) -> bool:
+        """Mark a document's rows dead in every live segment that holds it"""
+        found = False
+        for entry in manifest["segments"]:
+            if document_id in entry["documents"]:
+                dead = manifest["tombstones"].setdefault(entry["name"], [])
+                if document_id not in dead:
+                    dead.append(document_id)
+                    found = True
+        return found
+
+    def append(self, vectors: List[Dict[str, Any]], document_id: str) -> str:
+        """Write a document's vectors as a new segment, superseding its earlier rows"""
+        with self._lock:
+            manifest = self.read_manifest()
+            name = f"seg-{manifest['next_segment']:08d}"
+            manifest["next_segment"] += 1
+
+            write_segment(self.course_dir, name, vectors, [document_id] * len(vectors))
+            entry = self._segment_entry(
+                name, len(vectors), len(vectors[0]["vector"]) if vectors else 0, [document_id]
+            )
+
+            self._tombstone(manifest, document_id)
+            manifest["segments"].append(entry)
+            if manifest.get("documents") is not None:
+                manifest["documents"][document_id] = {
+                    "vectors": entry["rows"],
+                    "dimension": entry["dimension"],
+                    "bytes": entry["bytes"],
+                    "updated_at": entry["created_at"]
+                }
+            self._publish(manifest)
+            return name
+
+    def delete_document(self, document_id: str) -> bool:
+        """Tombstone a document; its rows disappear from the next snapshot"""
+        with self._lock:
+            manifest = self.read_manifest()
+            if not self._tombstone(manifest, document_id):
+                return False
+            if manifest.get("documents") is not None:
+                manifest["documents"].pop(document_id, None)
+            self._publish(manifest)
+            return True
+
+    def purge_retired(self, grace_seconds: float) -> int:
+        """Delete files of segments retired more than grace_seconds ago"""
+        with self._lock:
+            manifest = self.read_manifest()
+            cutoff = time.time() - grace_seconds
+            expired = [r for r in manifest["retired"] if r["retired_at"] <= cutoff]
+            if not expired:
+                return 0
+            manifest["retired"] = [r for r in manifest["retired"] if r["retired_at"] > cutoff]
+            self._publish(manifest)
+
+        for retired in expired:
+            delete_segment(self.course_dir, retired["name"])
+        return len(expired)
+
+    def compact(self, min_segments: int, small_rows: int) -> bool:
+        """Merge small or partly dead segments into one, dropping tombstoned rows.
+
+        The merged segment is written outside the lock; only publishing the
+        manifest that swaps it in is serialized with other writers. Replaced
+        segments are retired, not deleted, so readers holding an older
+        snapshot can finish; purge_retired removes them later.
+        """
+        with self._lock:
+            before = self.read_manifest()
+        candidates = [
+            entry for entry in before["segments"]
+            if entry["rows"] is None or entry["rows"] < small_rows or entry["name"] in before["tombstones"]
+        ]
+        has_dead_rows = any(entry["name"] in before["tombstones"] for entry in candidates)
+        if len(candidates) < min_segments and not has_dead_rows:
+            return False
+
+        # Gather the live rows of every candidate, in manifest order. Content-addressed
+        # rows keep referencing the content store; the rest are copied into the merged segment.
+        ids: List[str] = []
+        document_ids: List[str] = []
+        payloads: List[Dict[str, Any]] = []
+        content_keys: List[Optional[str]] = []
+        blocks: List[Tuple[Segment, List[int]]] = []
+        for entry in candidates:
+            segment = load_segment(self.course_dir, entry["name"])
+            if segment is None:
+                continue
+            dead: Set[str] = set(before["tombstones"].get(entry["name"], []))
+            rows = [i for i, document_id in enumerate(segment.document_ids) if document_id not in dead]
+            if not rows:
+                continue
+            ids.extend(segment.ids[i] for i in rows)
+            document_ids.extend(segment.document_ids[i] for i in rows)
+            payloads.extend(segment.payloads.get(rows))
+            dimension = segment.vectors.shape[1]
+            if segment.content_keys is not None:
+                content_keys.extend(segment.content_keys[i] for i in rows)
+            else:
+                content_keys.extend([None] * len(rows))
+            blocks.append((segment, rows))
+
+        merged_entry = None
+        if ids:
+            name = f"seg-c{uuid.uuid4().hex[:12]}"
+            if all(key is not None for key in content_keys):
+                merged = [
+                    {"id": i, "content_key": k, "payload": p}
+                    for i, k, p in zip(ids, content_keys, payloads)
+                ]
+            else:
+                vectors = np.concatenate([
+                    np.asarray(segment.vectors[rows], dtype=np.float32) for segment, rows in blocks
+                ])
+                merged = [{"id": i, "vector": v, "payload": p} for i, v, p in zip(ids, vectors, payloads)]
+            write_segment(self.course_dir, name, merged, document_ids)
+            merged_entry = self._segment_entry(name, len(ids), dimension, sorted(set(document_ids)))
+
+        with self._lock:
+            manifest = self.read_manifest()
+            candidate_names = {entry["name"] for entry in candidates}
+
+            # Documents tombstoned while we were merging are dead in the merged segment too
+            late_tombstones: Set[str] = set()
+            for name in candidate_names:
+                late_tombstones.update(
+                    set(manifest["tombstones"].pop(name, [])) - set(before["tombstones"].get(name, []))
+                )
+            if merged_entry is not None and late_tombstones:
+                manifest["tombstones"][merged_entry["name"]] = sorted(late_tombstones)
+
+            # The merged segment takes the place of the first segment it replaces
+            segments = []
+            for entry in manifest["segments"]:
+                if entry["name"] not in candidate_names:
+                    segments.append(entry)
+                elif merged_entry is not None:
+                    segments.append(merged_entry)
+                    merged_entry = None
+            manifest["segments"] = segments
+
+            now = time.time()
+            manifest["retired"].extend({"name": name, "retired_at": now} for name in sorted(candidate_names))
+            self._publish(manifest)
+
+        logger.info(f"Compacted {len(candidates)} segments into {len(ids)} rows in {self.course_dir}")
+        return True
+
+    def _segment_mtime(self, name: str) -> float:
+        mtimes = [
+            os.path.getmtime(os.path.join(self.course_dir, f"{name}{suffix}"))
+            for suffix in SEGMENT_SUFFIXES
+            if os.path.exists(os.path.join(self.course_dir, f"{name}{suffix}"))
+        ]
+        return max(mtimes, default=time.time())
+
+    def _backfill_stats(self, manifest: Dict[str, Any]) -> bool:
+        """Fill in statistics missing from manifests written before they were kept"""
+        changed = False
+        for entry in manifest["segments"]:
+            if entry.get("bytes") is None or entry.get("rows") is None:
+                segment = load_segment(self.course_dir, entry["name"])
+                if segment is None:
+                    continue
+                entry["rows"] = len(segment)
+                entry["dimension"] = int(segment.vectors.shape[1]) if segment.vectors.ndim == 2 else 0
+                entry["bytes"] = self._segment_bytes(entry["name"])
+                entry["created_at"] = self._segment_mtime(entry["name"])
+                changed = True
+
+        if manifest.get("documents") is None:
+            documents: Dict[str, Dict[str, Any]] = {}
+            for entry in manifest["segments"]:
+                segment = load_segment(self.course_dir, entry["name"])
+                if segment is None or len(segment) == 0:
+                    continue
+                dead = set(manifest["tombstones"].get(entry["name"], []))
+                bytes_per_row = entry["bytes"] / len(segment)
+                for document_id in segment.document_ids:
+                    if document_id in dead:
+                        continue
+                    stats = documents.setdefault(document_id, {
+                        "vectors": 0, "dimension": entry["dimension"], "bytes": 0.0, "updated_at": 0.0
+                    })
+                    stats["vectors"] += 1
+                    stats["bytes"] += bytes_per_row
+                    stats["updated_at"] = max(stats["updated_at"], entry["created_at"])
+            for stats in documents.values():
+                stats["bytes"] = int(stats["bytes"])
+            manifest["documents"] = documents
+            changed = True
+        return changed
+
+    def stats(self, persist: bool = True) -> Dict[str, Any]:
+        """Vector counts, dimensions, bytes on disk and last-modified time, per course and per document.
+
+        Read from the manifest; older manifests are backfilled by one pass
+        over their segments, which is saved unless persist is False.
+        """
+        manifest = self.read_manifest()
+        if manifest.get("documents") is None or any(e.get("bytes") is None for e in manifest["segments"]):
+            with self._lock:
+                manifest = self.read_manifest()
+                if self._backfill_stats(manifest) and persist:
+                    self._publish(manifest)
+
+        documents = manifest["documents"]
+        # More than one dimension means the embedding model changed without a re-index
+        dimensions = sorted({e["dimension"] for e in manifest["segments"] if e.get("rows")})
+        return {
+            "vectors": sum(d["vectors"] for d in documents.values()),
+            "documents": len(documents),
+            "dimensions": dimensions,
+            "segments": len(manifest["segments"]),
+            "bytes": sum(e.get("bytes") or 0 for e in manifest["segments"]),
+            "retired_segments": len(manifest["retired"]),
+            "last_modified": manifest.get("updated_at") or max(
+                (d["updated_at"] for d in documents.values()), default=None
+            ),
+            "per_document": documents
+        }
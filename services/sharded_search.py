@@ -0,0 +1,155 @@
+import os
+import numpy as np
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from .vector_search import select_top_k
+
+# A shard is a list of pieces: (vector file, first segment row, end segment row,
+# selected segment rows or None for the whole range). Workers memory-map the
+# vector files themselves, so only these descriptions and the query are pickled.
+ShardPiece = Tuple[str, int, int, Optional[np.ndarray]]
+
+# Per-worker caches. Segment names are reused after a course is deleted or migrated,
+# so entries are tied to the file's identity (inode, mtime) and not just its path.
+MAX_CACHED_ENTRIES = 256
+FileIdentity = Tuple[int, int]
+_vectors: "OrderedDict[str, Tuple[FileIdentity, np.ndarray]]" = OrderedDict()
+_inverse_norms: "OrderedDict[Tuple[str, FileIdentity, int, int], np.ndarray]" = OrderedDict()
+
+
+def _file_identity(path: str) -> Optional[FileIdentity]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _release_stale_files():
+    """Drop maps of files deleted or replaced since they were mapped, releasing their disk space"""
+    for path, (identity, _) in list(_vectors.items()):
+        if _file_identity(path) != identity:
+            del _vectors[path]
+    for key in list(_inverse_norms):
+        path, identity = key[0], key[1]
+        if path not in _vectors or _vectors[path][0] != identity:
+            del _inverse_norms[key]
+
+
+def _mapped_vectors(path: str) -> Tuple[FileIdentity, np.ndarray]:
+    identity = _file_identity(path)
+    entry = _vectors.get(path)
+    if entry is not None and entry[0] == identity:
+        _vectors.move_to_end(path)
+        return entry
+    # Mapping a file not seen before is rare, so check the other maps for stale files meanwhile
+    _release_stale_files()
+    entry = (identity, np.load(path, mmap_mode='r'))
+    _vectors[path] = entry
+    if len(_vectors) > MAX_CACHED_ENTRIES:
+        _vectors.popitem(last=False)
+    return entry
+
+
+def _cached(cache: OrderedDict, key, build):
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache[key] = value
+        if len(cache) > MAX_CACHED_ENTRIES:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+    return value
+
+
+def _inverse_row_norms(block: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(block, axis=1)
+    # Zero vectors score zero instead of NaN
+    norms[norms == 0] = 1.0
+    return (1.0 / norms).astype(np.float32)
+
+
+def score_shard(pieces: List[ShardPiece], query: np.ndarray, limit: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Partial top-k of one shard: positions within the shard's rows and their cosine scores.
+
+    Runs in a worker process.
+    """
+    parts = []
+    for path, start, end, rows in pieces:
+        identity, vectors = _mapped_vectors(path)
+        if rows is None:
+            block = vectors[start:end]
+            inverse_norms = _cached(_inverse_norms, (path, identity, start, end), lambda: _inverse_row_norms(block))
+        else:
+            block = vectors[rows]
+            inverse_norms = _inverse_row_norms(block)
+        parts.append((block @ query) * inverse_norms)
+
+    if not parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    scores = np.concatenate(parts)
+    selected = select_top_k(scores, limit, -np.inf)
+    return selected, scores[selected]
+
+
+def locate_rows(vectors, rows: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """File and file row holding each of `rows` of a segment's vectors, or None if not memory-mappable"""
+    if hasattr(vectors, "locate"):
+        return vectors.locate(rows)
+    filename = getattr(vectors, "filename", None)
+    if filename is None:
+        return None
+    return np.full(len(rows), filename, dtype=object), rows
+
+
+def plan_shards(
+    segment_vectors: List,
+    segment_index: np.ndarray,
+    segment_rows: np.ndarray,
+    rows: np.ndarray,
+    n_shards: int
+) -> Optional[List[Tuple[List[ShardPiece], np.ndarray]]]:
+    """Split course matrix `rows` into up to n_shards shards of about equal size.
+
+    Returns (pieces, matrix rows) per shard, where the matrix rows line up
+    with the positions score_shard returns, or None if any segment involved
+    has vectors that are not in memory-mappable files.
+    """
+    if rows.size == 0:
+        return []
+
+    # Resolve every row to its file and row within that file
+    order = np.argsort(segment_index[rows], kind='stable')
+    rows = rows[order]
+    segments = segment_index[rows]
+    boundaries = np.flatnonzero(np.diff(segments)) + 1
+    files, file_rows = [], []
+    for run in np.split(np.arange(rows.size), boundaries):
+        located = locate_rows(segment_vectors[segments[run[0]]], segment_rows[rows[run]])
+        if located is None:
+            return None
+        files.append(located[0])
+        file_rows.append(located[1])
+    paths, file_codes = np.unique(np.concatenate(files), return_inverse=True)
+    file_rows = np.concatenate(file_rows).astype(np.int64)
+
+    # Order by file and row so pieces become contiguous ranges where possible
+    order = np.lexsort((file_rows, file_codes))
+    rows, file_codes, file_rows = rows[order], file_codes[order], file_rows[order]
+
+    shard_size = -(-rows.size // max(1, n_shards))
+    shards = []
+    for shard_start in range(0, rows.size, shard_size):
+        shard = slice(shard_start, shard_start + shard_size)
+        codes, shard_file_rows = file_codes[shard], file_rows[shard]
+        pieces: List[ShardPiece] = []
+        for piece in np.split(np.arange(codes.size), np.flatnonzero(np.diff(codes)) + 1):
+            piece_rows = shard_file_rows[piece]
+            start, end = int(piece_rows[0]), int(piece_rows[-1]) + 1
+            # A contiguous run is sent as a range the worker can slice and cache norms for
+            selected = None if end - start == piece.size else piece_rows
+            pieces.append((str(paths[codes[piece[0]]]), start, end, selected))
+        shards.append((pieces, rows[shard]))
+    return shards
@@ -0,0 +1,283 @@
+import os
+import logging
+import numpy as np
+from datetime import timezone
+from typing import List, Dict, Any, Optional, Sequence
+from sqlalchemy import create_engine, select, delete, func, event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.database import engine as async_engine, AsyncSessionLocal, ChunkVector, DocumentChunk
+from .file_vector_store import FileVectorStore
+from .vector_segments import Segment
+from .vector_cache import CourseMatrix
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters in one statement
+SELECT_BATCH = 500
+
+
+def _sync_engine():
+    """Blocking engine on the application database, for reads from the synchronous search path"""
+    url = async_engine.url
+    return create_engine(url.set(drivername=url.get_backend_name()))
+
+
+def _timestamp(value) -> Optional[float]:
+    # Columns hold naive UTC datetimes; stats report epoch seconds like the file store
+    return value.replace(tzinfo=timezone.utc).timestamp() if value is not None else None
+
+
+class ChunkPayloads:
+    """Search payloads read from document_chunks on demand, so chunk text is stored only once"""
+
+    def __init__(self, engine, chunk_ids: List[str]):
+        self._engine = engine
+        self._chunk_ids = chunk_ids
+
+    def __len__(self) -> int:
+        return len(self._chunk_ids)
+
+    def get(self, rows: Sequence[int]) -> List[Dict[str, Any]]:
+        ids = [self._chunk_ids[row] for row in rows]
+        found = {}
+        with self._engine.connect() as conn:
+            for start in range(0, len(ids), SELECT_BATCH):
+                result = conn.execute(
+                    select(
+                        DocumentChunk.id, DocumentChunk.course_id, DocumentChunk.document_id,
+                        DocumentChunk.chunk_index, DocumentChunk.content,
+                        DocumentChunk.chunk_metadata, DocumentChunk.chunk_type
+                    ).where(DocumentChunk.id.in_(ids[start:start + SELECT_BATCH]))
+                )
+                for chunk in result:
+                    found[chunk.id] = {
+                        "course_id": chunk.course_id,
+                        "document_id": chunk.document_id,
+                        "chunk_index": chunk.chunk_index,
+                        "content": chunk.content,
+                        "metadata": chunk.chunk_metadata or {},
+                        "chunk_type": chunk.chunk_type
+                    }
+        return [found.get(chunk_id, {}) for chunk_id in ids]
+
+
+class SQLiteVectorStore(FileVectorStore):
+    """Vector store keeping float32 embeddings as BLOBs in the application database, keyed by chunk id.
+
+    Writes join the caller's transaction, so a document's chunks and their
+    vectors commit or roll back together. A course loads in one SELECT and is
+    then searched exactly like a file store course. The ANN and BM25 indexes
+    are derived data and are still saved under the storage directory.
+    """
+
+    def __init__(self, storage_dir: str = None):
+        super().__init__(storage_dir)
+        self.engine = _sync_engine()
+        if not inspect(self.engine).has_table(ChunkVector.__tablename__):
+            raise RuntimeError(
+                f"VECTOR_STORE_BACKEND=sqlite needs the {ChunkVector.__tablename__} table; "
+                "run `alembic upgrade head` to create it"
+            )
+
+    def _read_course_matrix(self, course_id: str) -> CourseMatrix:
+        """Build the course matrix from the course's vector rows in one query"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(
+                    ChunkVector.chunk_id, ChunkVector.document_id, ChunkVector.vector,
+                    DocumentChunk.chunk_type, DocumentChunk.chunk_metadata
+                )
+                .join(DocumentChunk, DocumentChunk.id == ChunkVector.chunk_id)
+                .where(ChunkVector.course_id == course_id)
+                .order_by(DocumentChunk.document_id, DocumentChunk.chunk_index)
+            ).all()
+        if not rows:
+            return CourseMatrix.empty(self.quantization)
+        if len({len(row.vector) for row in rows}) > 1:
+            raise ValueError(f"Course {course_id} mixes embedding dimensions; re-index it with one model")
+
+        ids = [row.chunk_id for row in rows]
+        vectors = np.frombuffer(b"".join(row.vector for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        segment = Segment(
+            f"db-{course_id}", ids, vectors, ChunkPayloads(self.engine, ids),
+            document_ids=[row.document_id for row in rows],
+            attributes={
+                "chunk_type": [row.chunk_type for row in rows],
+                "filename": [(row.chunk_metadata or {}).get("filename") for row in rows]
+            }
+        )
+        course_matrix = CourseMatrix.from_segments([segment], self.quantization)
+        logger.info(f"Loaded {len(course_matrix)} vectors from the database for course {course_id}")
+        return course_matrix
+
+    def _stored(self, course_id: str, document_id: str):
+        """Make committed vector rows visible to searches"""
+        # A load that read the rows before the commit finishes first and is dropped here
+        with self._course_load_lock(course_id):
+            self.cache.invalidate(course_id)
+        try:
+            self._invalidate_course_centroids(course_id)
+            self._update_ann_index(course_id, document_id)
+        except Exception as e:
+            logger.error(f"Error updating ANN index for course {course_id}: {e}")
+
+    async def store_vectors(self, vectors: List[Dict[str, Any]], course_id: str, document_id: str, db_session: Optional[AsyncSession] = None) -> List[str]:
+        """Store a document's vectors, replacing its earlier ones, and return their ids.
+
+        Vector ids must be DocumentChunk ids. With a db_session the rows are
+        written in the caller's transaction and searches see them once it
+        commits; without one they are committed here.
+        """
+        session = db_session or AsyncSessionLocal()
+        try:
+            await session.execute(delete(ChunkVector).where(ChunkVector.document_id == document_id))
+            session.add_all([
+                ChunkVector(
+                    chunk_id=vector["id"],
+                    document_id=document_id,
+                    course_id=course_id,
+                    vector=np.asarray(vector["vector"], dtype=np.float32).tobytes(),
+                    dimension=len(vector["vector"]),
+                    content_key=vector.get("content_key")
+                )
+                for vector in vectors
+            ])
+            await session.flush()
+
+            if db_session is None:
+                await session.commit()
+                await self.run_io(self._stored, course_id, document_id)
+            else:
+                # The hook runs on the event loop, so the index update is handed to the I/O pool
+                event.listen(
+                    session.sync_session, "after_commit",
+                    lambda _: self._io_pool.submit(self._stored, course_id, document_id), once=True
+                )
+
+            logger.info(f"SUCCESS: Stored {len(vectors)} vectors for document {document_id} in the database")
+            return [vector["id"] for vector in vectors]
+        except Exception as e:
+            logger.error(f"ERROR in store_vectors: {str(e)}")
+            logger.error(f"Course ID: {course_id}, Document ID: {document_id}")
+            raise
+        finally:
+            if db_session is None:
+                await session.close()
+
+    def lookup_embeddings(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """Embeddings already stored for content keys, from any course"""
+        unique = list(dict.fromkeys(keys))
+        found = {}
+        with self.engine.connect() as conn:
+            for start in range(0, len(unique), SELECT_BATCH):
+                result = conn.execute(
+                    select(ChunkVector.content_key, ChunkVector.vector)
+                    .where(ChunkVector.content_key.in_(unique[start:start + SELECT_BATCH]))
+                )
+                for row in result:
+                    found[row.content_key] = np.frombuffer(row.vector, dtype=np.float32)
+        return found
+
+    async def delete_document(self, document_id: str, course_id: str, db_session: Optional[AsyncSession] = None) -> bool:
+        """Delete vectors for a document"""
+        session = db_session or AsyncSessionLocal()
+        try:
+            result = await session.execute(delete(ChunkVector).where(ChunkVector.document_id == document_id))
+            if db_session is None:
+                await session.commit()
+            await self.run_io(self._forget_document, course_id, document_id)
+
+            if result.rowcount:
+                logger.info(f"Deleted {result.rowcount} vectors for document {document_id}")
+                return True
+            logger.warning(f"No vectors found for document {document_id}")
+            return False
+        except Exception as e:
+            logger.error(f"ERROR in delete_document: {str(e)}")
+            return False
+        finally:
+            if db_session is None:
+                await session.close()
+
+    async def delete_course(self, course_id: str, db_session: Optional[AsyncSession] = None) -> bool:
+        """Delete all vectors for a course, and its search index files"""
+        session = db_session or AsyncSessionLocal()
+        try:
+            result = await session.execute(delete(ChunkVector).where(ChunkVector.course_id == course_id))
+            if db_session is None:
+                await session.commit()
+        except Exception as e:
+            logger.error(f"ERROR in delete_course: {str(e)}")
+            return False
+        finally:
+            if db_session is None:
+                await session.close()
+
+        removed_indexes = await super().delete_course(course_id, db_session)
+        logger.info(f"Deleted {result.rowcount} vectors for course {course_id}")
+        return bool(result.rowcount) or removed_indexes
+
+    async def reinitialize(self):
+        """Remove all embeddings and search indexes"""
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(delete(ChunkVector))
+                await session.commit()
+        except Exception as e:
+            logger.error(f"Error reinitializing embeddings storage: {e}")
+            return False
+        return await super().reinitialize()
+
+    def course_ids(self) -> List[str]:
+        with self.engine.connect() as conn:
+            return list(conn.execute(select(ChunkVector.course_id).distinct()).scalars())
+
+    def get_course_stats(self, course_id: str, include_documents: bool = True) -> Optional[Dict[str, Any]]:
+        """Statistics of one course from aggregate queries, or None for a course without vectors"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(
+                    ChunkVector.document_id,
+                    func.count().label("vectors"),
+                    func.max(ChunkVector.dimension).label("dimension"),
+                    func.sum(func.length(ChunkVector.vector)).label("bytes"),
+                    func.max(ChunkVector.created_at).label("updated_at")
+                )
+                .where(ChunkVector.course_id == course_id)
+                .group_by(ChunkVector.document_id)
+            ).all()
+            dimensions = conn.execute(
+                select(ChunkVector.dimension).where(ChunkVector.course_id == course_id).distinct()
+            ).scalars().all()
+        if not rows:
+            return None
+
+        documents = {
+            row.document_id: {
+                "vectors": row.vectors,
+                "dimension": row.dimension,
+                "bytes": int(row.bytes or 0),
+                "updated_at": _timestamp(row.updated_at)
+            }
+            for row in rows
+        }
+        course_dir = self.course_index.get(course_id) or os.path.join(self.storage_dir, course_id)
+        stats = {
+            "vectors": sum(d["vectors"] for d in documents.values()),
+            "documents": len(documents),
+            "dimensions": sorted(dimensions),
+            "bytes": sum(d["bytes"] for d in documents.values()),
+            "last_modified": max((d["updated_at"] for d in documents.values() if d["updated_at"]), default=None),
+            "index_bytes": self._index_bytes(course_dir),
+            "directory": os.path.basename(course_dir) if os.path.isdir(course_dir) else None
+        }
+        if include_documents:
+            stats["per_document"] = documents
+        return stats
+
+    def compact_course(self, course_id: str) -> bool:
+        # Rows are replaced in place; there are no segments to merge
+        return False
+
+    def start_compactor(self):
+        pass
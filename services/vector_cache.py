@@ -0,0 +1,395 @@
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Sequence, Set, Callable
+
+from .vector_segments import ATTRIBUTE_FIELDS, Segment
+from .vector_filters import FilterIndex
+from .quantization import quantize_rows, dequantize_rows, score_rows
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Return a contiguous float32 copy of matrix with every row scaled to unit length"""
+    matrix = np.array(matrix, dtype=np.float32, copy=True, order='C')
+    if matrix.size == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    # Zero vectors stay zero instead of turning into NaNs
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+
+class CourseMatrix:
+    """All vectors of one course as a single pre-normalized matrix with parallel ids.
+
+    Payloads are not held in memory: each row points back at its segment
+    (segments[segment_index[row]], row segment_rows[row]) and payloads are
+    read only for the rows a search returns. With quantization enabled the
+    resident matrix holds float16 or int8 codes (int8 with a per-row scale
+    and offset); the full-precision rows stay in the memory-mapped segments
+    and are only read to rescore candidates.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        matrix: np.ndarray,
+        document_ids: np.ndarray,
+        segments: List[Segment],
+        segment_index: np.ndarray,
+        segment_rows: np.ndarray,
+        quantization: str = "none",
+        scales: Optional[np.ndarray] = None,
+        offsets: Optional[np.ndarray] = None,
+        attributes: Optional[Dict[str, np.ndarray]] = None
+    ):
+        self.ids = ids
+        self.matrix = matrix
+        self.document_ids = document_ids
+        self.segments = segments
+        self.segment_index = segment_index
+        self.segment_rows = segment_rows
+        self.quantization = quantization
+        self.scales = scales
+        self.offsets = offsets
+        # Filterable payload fields per row, parallel to ids
+        self.attributes = attributes if attributes is not None else {
+            field: np.full(len(ids), None, dtype=object) for field in ATTRIBUTE_FIELDS
+        }
+        # IVF list grouping of these rows, filled in on the first approximate search
+        self.ann_lists = None
+        # (worker count, shards) over all rows, filled in on the first sharded search
+        self.shard_plan = None
+        # Inverted indexes over document ids and attributes, built on the first filtered search
+        self._filter_index: Optional[FilterIndex] = None
+        # Vector id -> row, built on the first lookup by id
+        self._row_of: Optional[Dict[str, int]] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def dimension(self) -> int:
+        return self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+
+    @property
+    def nbytes(self) -> int:
+        total = self.matrix.nbytes
+        if self.scales is not None:
+            total += self.scales.nbytes + self.offsets.nbytes
+        return int(total)
+
+    @property
+    def is_quantized(self) -> bool:
+        return self.quantization != "none"
+
+    @classmethod
+    def empty(cls, quantization: str = "none") -> "CourseMatrix":
+        return cls(
+            np.empty(0, dtype=object),
+            np.zeros((0, 0), dtype=np.float32),
+            np.empty(0, dtype=object),
+            [],
+            np.empty(0, dtype=np.int32),
+            np.empty(0, dtype=np.int64),
+            quantization=quantization
+        )
+
+    @classmethod
+    def from_segments(
+        cls,
+        segments: List[Segment],
+        quantization: str = "none",
+        tombstones: Optional[Dict[str, List[str]]] = None
+    ) -> "CourseMatrix":
+        """Build a course matrix from a snapshot of segments, skipping tombstoned rows"""
+        tombstones = tombstones or {}
+        live_segments = []
+        live_rows = []
+        for segment in segments:
+            dead = set(tombstones.get(segment.name, []))
+            if dead:
+                rows = np.array([i for i, d in enumerate(segment.document_ids) if d not in dead], dtype=np.int64)
+            else:
+                rows = np.arange(len(segment), dtype=np.int64)
+            if rows.size:
+                live_segments.append(segment)
+                live_rows.append(rows)
+        if not live_segments:
+            return cls.empty(quantization)
+
+        ids = np.empty(sum(len(rows) for rows in live_rows), dtype=object)
+        ids[:] = [s.ids[i] for s, rows in zip(live_segments, live_rows) for i in rows]
+        document_ids = np.empty(len(ids), dtype=object)
+        document_ids[:] = [s.document_ids[i] for s, rows in zip(live_segments, live_rows) for i in rows]
+        segment_index = np.concatenate([np.full(len(rows), i, dtype=np.int32) for i, rows in enumerate(live_rows)])
+        segment_rows = np.concatenate(live_rows)
+        attributes = {}
+        for field in ATTRIBUTE_FIELDS:
+            attributes[field] = np.empty(len(ids), dtype=object)
+            attributes[field][:] = [s.attributes[field][i] for s, rows in zip(live_segments, live_rows) for i in rows]
+
+        matrix = np.ascontiguousarray(np.concatenate([
+            normalize_rows(s.vectors if len(rows) == len(s) else s.vectors[rows])
+            for s, rows in zip(live_segments, live_rows)
+        ]))
+        codes, scales, offsets = quantize_rows(matrix, quantization)
+        segments = live_segments
+
+        return cls(
+            ids, codes, document_ids, segments, segment_index, segment_rows,
+            quantization=quantization, scales=scales, offsets=offsets, attributes=attributes
+        )
+
+    def _take(self, selection: np.ndarray) -> "CourseMatrix":
+        return CourseMatrix(
+            self.ids[selection],
+            np.ascontiguousarray(self.matrix[selection]),
+            self.document_ids[selection],
+            self.segments,
+            self.segment_index[selection],
+            self.segment_rows[selection],
+            quantization=self.quantization,
+            scales=None if self.scales is None else self.scales[selection],
+            offsets=None if self.offsets is None else self.offsets[selection],
+            attributes={field: values[selection] for field, values in self.attributes.items()}
+        )
+
+    def without_document(self, document_id: str) -> "CourseMatrix":
+        """Return a copy with every row of document_id removed"""
+        return self._take(self.document_ids != document_id)
+
+    def with_segment(self, segment: Segment) -> "CourseMatrix":
+        """Return a copy with the rows of segment replacing the previous rows of its documents"""
+        base = self
+        for document_id in set(segment.document_ids):
+            base = base.without_document(document_id)
+        if len(segment) == 0:
+            return base
+        if len(base) == 0:
+            return CourseMatrix.from_segments([segment], self.quantization)
+
+        added = CourseMatrix.from_segments([segment], self.quantization)
+        if added.dimension != base.dimension:
+            raise ValueError(
+                f"Vector dimension {added.dimension} does not match course dimension {base.dimension}"
+            )
+
+        def join(a, b):
+            return None if a is None else np.concatenate([a, b])
+
+        return CourseMatrix(
+            np.concatenate([base.ids, added.ids]),
+            np.ascontiguousarray(np.concatenate([base.matrix, added.matrix])),
+            np.concatenate([base.document_ids, added.document_ids]),
+            # The added rows point at their own segment, appended after the base segments
+            base.segments + added.segments,
+            np.concatenate([base.segment_index, added.segment_index + len(base.segments)]),
+            np.concatenate([base.segment_rows, added.segment_rows]),
+            quantization=self.quantization,
+            scales=join(base.scales, added.scales),
+            offsets=join(base.offsets, added.offsets),
+            attributes={
+                field: np.concatenate([values, added.attributes[field]])
+                for field, values in base.attributes.items()
+            }
+        )
+
+    def filter_rows(self, filters: Optional[Dict[str, List[str]]]) -> Optional[np.ndarray]:
+        """Rows matching metadata filters, in row order, or None when nothing is filtered"""
+        if not filters:
+            return None
+        if self._filter_index is None:
+            self._filter_index = FilterIndex({"document_id": self.document_ids, **self.attributes})
+        return self._filter_index.rows(filters)
+
+    def rows_for_ids(self, ids: Sequence[str]) -> np.ndarray:
+        """Row of each vector id, or -1 for ids not in the matrix"""
+        if self._row_of is None:
+            self._row_of = {vector_id: row for row, vector_id in enumerate(self.ids)}
+        return np.array([self._row_of.get(vector_id, -1) for vector_id in ids], dtype=np.int64)
+
+    def payloads(self, rows: Sequence[int]) -> List[Dict[str, Any]]:
+        """Read the payloads of `rows` from their segments, in the order given"""
+        payloads: List[Optional[Dict[str, Any]]] = [None] * len(rows)
+        by_segment: Dict[int, List[int]] = {}
+        for position, row in enumerate(rows):
+            by_segment.setdefault(int(self.segment_index[row]), []).append(position)
+
+        for segment_number, positions in by_segment.items():
+            segment_rows = [int(self.segment_rows[rows[p]]) for p in positions]
+            for position, payload in zip(positions, self.segments[segment_number].payloads.get(segment_rows)):
+                payloads[position] = payload
+        return payloads
+
+    def score(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cosine similarity of a unit query with all rows (or `rows`), using the resident matrix"""
+        if query.shape[0] != self.dimension:
+            raise ValueError(f"Query dimension {query.shape[0]} does not match vector dimension {self.dimension}")
+        return score_rows(self.matrix, query, self.scales, self.offsets, rows)
+
+    def score_many(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cosine similarities of unit queries (queries x dim) with all rows (or `rows`), one row per query"""
+        if queries.shape[1] != self.dimension:
+            raise ValueError(f"Query dimension {queries.shape[1]} does not match vector dimension {self.dimension}")
+        return score_rows(self.matrix, queries, self.scales, self.offsets, rows).T
+
+    def exact_score(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Cosine similarity of a unit query with `rows`, read from the full-precision segments"""
+        if not self.is_quantized:
+            return self.score(query, rows)
+        vectors = np.empty((len(rows), self.dimension), dtype=np.float32)
+        for i, row in enumerate(rows):
+            vectors[i] = self.segments[self.segment_index[row]].vectors[self.segment_rows[row]]
+        return normalize_rows(vectors) @ query
+
+    def vectors(self, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Normalized float32 rows, dequantized when the matrix is quantized"""
+        selection = slice(None) if rows is None else rows
+        if not self.is_quantized:
+            return self.matrix[selection]
+        scales = None if self.scales is None else self.scales[selection]
+        offsets = None if self.offsets is None else self.offsets[selection]
+        return dequantize_rows(self.matrix[selection], scales, offsets)
+
+
+class CourseMatrixCache:
+    """In-process LRU cache of course matrices, kept in step with vector store writes.
+
+    With a byte budget the least recently searched courses are evicted once
+    the resident matrices exceed it; they are rebuilt from their segments on
+    the next search. Pinned courses are never evicted. A single course larger
+    than the budget is still kept until another course is used.
+    """
+
+    def __init__(self, max_bytes: int = 0, pinned: Optional[Sequence[str]] = None,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self._matrices: "OrderedDict[str, CourseMatrix]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 0 means unbounded
+        self.max_bytes = max_bytes
+        self.pinned: Set[str] = set(pinned or ())
+        # Called with each evicted course id, outside the lock, to drop state kept alongside the matrix
+        self.on_evict = on_evict
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, course_id: str) -> Optional[CourseMatrix]:
+        """Cached matrix of a course, counted as a use for hit/miss and eviction order"""
+        with self._lock:
+            course_matrix = self._matrices.get(course_id)
+            if course_matrix is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._matrices.move_to_end(course_id)
+            return course_matrix
+
+    def peek(self, course_id: str) -> Optional[CourseMatrix]:
+        """Cached matrix of a course without counting a use"""
+        with self._lock:
+            return self._matrices.get(course_id)
+
+    def _set(self, course_id: str, course_matrix: CourseMatrix):
+        previous = self._matrices.get(course_id)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+        self._matrices[course_id] = course_matrix
+        self._matrices.move_to_end(course_id)
+        self._bytes += course_matrix.nbytes
+
+    def _pop(self, course_id: str) -> Optional[CourseMatrix]:
+        course_matrix = self._matrices.pop(course_id, None)
+        if course_matrix is not None:
+            self._bytes -= course_matrix.nbytes
+        return course_matrix
+
+    def _evict(self, keep: Optional[str] = None) -> List[str]:
+        """Drop least recently used unpinned courses until within budget; caller holds the lock"""
+        evicted = []
+        if self.max_bytes <= 0:
+            return evicted
+        for course_id in list(self._matrices):
+            if self._bytes <= self.max_bytes:
+                break
+            if course_id == keep or course_id in self.pinned:
+                continue
+            self._pop(course_id)
+            evicted.append(course_id)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _evicted(self, evicted: List[str]):
+        for course_id in evicted:
+            logger.info(f"Evicted cached vectors for course {course_id}")
+            if self.on_evict is not None:
+                self.on_evict(course_id)
+
+    def put(self, course_id: str, course_matrix: CourseMatrix):
+        with self._lock:
+            self._set(course_id, course_matrix)
+            evicted = self._evict(keep=course_id)
+        logger.info(f"Cached {len(course_matrix)} vectors ({course_matrix.nbytes} bytes) for course {course_id}")
+        self._evicted(evicted)
+
+    def update_document(self, course_id: str, segment: Segment):
+        """Replace a document's rows in a cached course, if the course is cached"""
+        evicted = []
+        with self._lock:
+            course_matrix = self._matrices.get(course_id)
+            if course_matrix is None:
+                return
+            try:
+                self._set(course_id, course_matrix.with_segment(segment))
+                evicted = self._evict(keep=course_id)
+            except ValueError as e:
+                logger.warning(f"Invalidating cached vectors for course {course_id}: {e}")
+                self._pop(course_id)
+        self._evicted(evicted)
+
+    def remove_document(self, course_id: str, document_id: str):
+        """Drop a document's rows from a cached course, if the course is cached"""
+        with self._lock:
+            course_matrix = self._matrices.get(course_id)
+            if course_matrix is not None:
+                self._set(course_id, course_matrix.without_document(document_id))
+
+    def pin(self, course_id: str):
+        with self._lock:
+            self.pinned.add(course_id)
+
+    def unpin(self, course_id: str):
+        with self._lock:
+            self.pinned.discard(course_id)
+            evicted = self._evict()
+        self._evicted(evicted)
+
+    def invalidate(self, course_id: str):
+        with self._lock:
+            self._pop(course_id)
+
+    def clear(self):
+        with self._lock:
+            self._matrices.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "courses": len(self._matrices),
+                "vectors": sum(len(m) for m in self._matrices.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "pinned": sorted(self.pinned),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else None
+            }
@@ -0,0 +1,59 @@
+import numpy as np
+from typing import List, Dict, Optional, Sequence
+
+from .vector_segments import ATTRIBUTE_FIELDS
+
+# Fields a search can be restricted to; values within a field are OR-ed, fields are AND-ed
+FILTER_FIELDS = ("document_id",) + ATTRIBUTE_FIELDS
+
+
+def _as_strings(values: np.ndarray) -> np.ndarray:
+    # Rows without a value are indexed under the empty string
+    return np.asarray(["" if value is None else str(value) for value in values], dtype=str)
+
+
+class AttributeIndex:
+    """Inverted index from one attribute's values to the course matrix rows holding them"""
+
+    def __init__(self, values: np.ndarray):
+        if len(values):
+            self.values, codes = np.unique(_as_strings(values), return_inverse=True)
+        else:
+            self.values, codes = np.empty(0, dtype=str), np.empty(0, dtype=np.int64)
+        self.order = np.argsort(codes, kind='stable')
+        self.bounds = np.searchsorted(codes[self.order], np.arange(len(self.values) + 1))
+
+    def rows(self, wanted: Sequence[str]) -> np.ndarray:
+        """Rows whose value is any of `wanted`, in row order, each row once"""
+        # A value asked for twice would list its rows twice, and intersections assume unique rows
+        wanted = list(dict.fromkeys(wanted))
+        positions = np.searchsorted(self.values, wanted)
+        parts = [
+            self.order[self.bounds[p]:self.bounds[p + 1]]
+            for p, value in zip(positions, wanted)
+            if p < len(self.values) and self.values[p] == value
+        ]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(parts))
+
+
+class FilterIndex:
+    """Attribute indexes over every filterable field of one course matrix"""
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.indexes = {field: AttributeIndex(values) for field, values in columns.items()}
+
+    def rows(self, filters: Dict[str, List[str]]) -> Optional[np.ndarray]:
+        """Rows matching every field's filter values, in row order, or None without filters"""
+        matched: Optional[np.ndarray] = None
+        for field, wanted in filters.items():
+            if field not in self.indexes:
+                raise ValueError(f"Unknown filter field {field}, expected one of {', '.join(FILTER_FIELDS)}")
+            if isinstance(wanted, str):
+                wanted = [wanted]
+            rows = self.indexes[field].rows(list(wanted))
+            matched = rows if matched is None else np.intersect1d(matched, rows, assume_unique=True)
+            if matched.size == 0:
+                break
+        return matched
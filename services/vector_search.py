@@ -0,0 +1,63 @@
+import numpy as np
+from typing import List, Optional, Tuple
+
+
+def normalize_query(query_vector: List[float]) -> Optional[np.ndarray]:
+    """Return the query as a unit-length float32 vector, or None for a zero vector"""
+    query = np.asarray(query_vector, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    if norm == 0:
+        return None
+    return query / norm
+
+
+def normalize_queries(query_vectors: List[List[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Return unit-length float32 queries (queries x dim) and a mask of the non-zero ones"""
+    queries = np.asarray(query_vectors, dtype=np.float32)
+    norms = np.linalg.norm(queries, axis=1)
+    valid = norms > 0
+    queries[valid] /= norms[valid, None]
+    return queries, valid
+
+
+def select_top_k(scores: np.ndarray, limit: int, score_threshold: float) -> np.ndarray:
+    """Indices of the best `limit` scores at or above the threshold, best first.
+
+    Ties keep row order, matching a stable sort over the full score list.
+    """
+    if limit <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if limit < scores.size:
+        candidates = np.argpartition(-scores, limit - 1)[:limit]
+    else:
+        candidates = np.arange(scores.size)
+
+    candidates = candidates[scores[candidates] >= score_threshold]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+def mmr_select(scores: np.ndarray, vectors: np.ndarray, limit: int, diversity_lambda: float) -> np.ndarray:
+    """Positions of up to `limit` candidates picked by maximal marginal relevance, in pick order.
+
+    Each pick maximizes lambda * score - (1 - lambda) * (highest similarity to
+    an earlier pick). All pairwise similarities come from one product of the
+    unit-length candidate vectors; each pick is then a vector update.
+    """
+    count = min(max(limit, 0), len(scores))
+    selected = np.empty(count, dtype=np.int64)
+    if count == 0:
+        return selected
+
+    similarity = vectors @ vectors.T
+    relevance = diversity_lambda * scores
+    redundancy = np.zeros(len(scores), dtype=np.float32)
+    available = np.ones(len(scores), dtype=bool)
+    for step in range(count):
+        marginal = np.where(available, relevance - (1.0 - diversity_lambda) * redundancy, -np.inf)
+        best = int(np.argmax(marginal))
+        selected[step] = best
+        available[best] = False
+        redundancy = similarity[best] if step == 0 else np.maximum(redundancy, similarity[best])
+    return selected
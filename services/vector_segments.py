@@ -0,0 +1,297 @@
+import os
+import json
+import logging
+import numpy as np
+from typing import List, Dict, Any, Optional, Sequence, Set
+
+logger = logging.getLogger(__name__)
+
+# Binary segment layout, all in row order:
+#   <name>.npy            float32 (rows x dim) matrix, memory-mapped on load
+#   <name>.ids.json       vector ids, the document each row belongs to and its filter attributes
+#   <name>.payloads.jsonl one JSON payload per line
+#   <name>.payloads.idx   int64 byte offsets of each payload line (rows + 1 entries)
+# Payloads are only read for the rows a search actually returns. Segments whose
+# embeddings live in the shared content store have no .npy file; their ids
+# sidecar lists each row's content key instead and is written last.
+VECTORS_SUFFIX = ".npy"
+IDS_SUFFIX = ".ids.json"
+PAYLOADS_SUFFIX = ".payloads.jsonl"
+PAYLOAD_INDEX_SUFFIX = ".payloads.idx"
+LEGACY_SUFFIX = ".json"
+COURSE_INFO_FILE = "course_info.json"
+MANIFEST_FILE = "segments.json"
+
+# Payload fields copied into the ids sidecar so searches can filter rows without reading payloads
+ATTRIBUTE_FIELDS = ("chunk_type", "filename")
+
+SEGMENT_SUFFIXES = (VECTORS_SUFFIX, IDS_SUFFIX, PAYLOADS_SUFFIX, PAYLOAD_INDEX_SUFFIX, LEGACY_SUFFIX)
+
+
+class InlinePayloads:
+    """Payloads already held in memory, for segments that store them inline"""
+
+    def __init__(self, payloads: List[Dict[str, Any]]):
+        self._payloads = payloads
+
+    def __len__(self) -> int:
+        return len(self._payloads)
+
+    def get(self, rows: Sequence[int]) -> List[Dict[str, Any]]:
+        return [self._payloads[row] for row in rows]
+
+
+class PayloadFile:
+    """Payloads in a JSON-lines file, read on demand by byte offset"""
+
+    def __init__(self, path: str, offsets: np.ndarray):
+        self.path = path
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get(self, rows: Sequence[int]) -> List[Dict[str, Any]]:
+        payloads = []
+        with open(self.path, 'rb') as f:
+            for row in rows:
+                start = int(self.offsets[row])
+                f.seek(start)
+                payloads.append(json.loads(f.read(int(self.offsets[row + 1]) - start)))
+        return payloads
+
+
+class Segment:
+    """Immutable batch of vectors, with ids and document ids in row order and payloads readable by row"""
+
+    def __init__(self, name: str, ids: List[str], vectors: np.ndarray, payloads,
+                 document_ids: Optional[List[str]] = None,
+                 attributes: Optional[Dict[str, List[Optional[str]]]] = None,
+                 content_keys: Optional[List[str]] = None):
+        self.name = name
+        self.ids = ids
+        self.vectors = vectors
+        self.payloads = payloads
+        # Segments from before the segment log hold exactly one document, named after it
+        self.document_ids = document_ids if document_ids is not None else [name] * len(ids)
+        self._attributes = attributes
+        # Rows reference shared content store embeddings instead of a vector file of their own
+        self.content_keys = content_keys
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def attributes(self) -> Dict[str, List[Optional[str]]]:
+        """Filter attributes per row; older segments derive them from their payloads once"""
+        if self._attributes is None:
+            self._attributes = payload_attributes(self.payloads.get(range(len(self))))
+        return self._attributes
+
+
+def payload_attributes(payloads: List[Dict[str, Any]]) -> Dict[str, List[Optional[str]]]:
+    """Extract the filterable fields of each payload, in row order"""
+    return {
+        "chunk_type": [payload.get("chunk_type") for payload in payloads],
+        "filename": [(payload.get("metadata") or {}).get("filename") for payload in payloads]
+    }
+
+
+def atomic_write_json(path: str, data: Any):
+    """Write JSON to a temporary file and rename it into place"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def atomic_write_npy(path: str, array: np.ndarray):
+    """Write an .npy file to a temporary file and rename it into place"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def _write_payloads(path: str, payloads: List[Dict[str, Any]]) -> np.ndarray:
+    """Write payloads as JSON lines and return the byte offset of every line"""
+    offsets = np.zeros(len(payloads) + 1, dtype=np.int64)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for i, payload in enumerate(payloads):
+            line = json.dumps(payload).encode('utf-8') + b"\n"
+            f.write(line)
+            offsets[i + 1] = offsets[i] + len(line)
+    os.replace(tmp_path, path)
+    return offsets
+
+
+def _to_matrix(vectors: List[Dict[str, Any]]) -> np.ndarray:
+    """Stack the "vector" entries of vector dicts into a float32 matrix"""
+    if not vectors:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.asarray([v["vector"] for v in vectors], dtype=np.float32)
+
+
+def is_segment_file(file_name: str) -> bool:
+    """Check whether a file in a course directory holds segment vectors"""
+    if file_name.endswith(VECTORS_SUFFIX):
+        return True
+    return (
+        file_name.endswith(LEGACY_SUFFIX)
+        and not file_name.endswith(IDS_SUFFIX)
+        and file_name not in (COURSE_INFO_FILE, MANIFEST_FILE)
+    )
+
+
+def is_store_file(file_name: str) -> bool:
+    """Check whether a file in a course directory belongs to the vector store"""
+    return file_name in (COURSE_INFO_FILE, MANIFEST_FILE) or file_name.endswith(SEGMENT_SUFFIXES)
+
+
+def segment_name(file_name: str) -> str:
+    """Get the segment name (document id) for a segment file name"""
+    if file_name.endswith(VECTORS_SUFFIX):
+        return file_name[:-len(VECTORS_SUFFIX)]
+    return file_name[:-len(LEGACY_SUFFIX)]
+
+
+def list_segments(course_dir: str) -> List[str]:
+    """List segment names in a course directory, binary and legacy JSON alike"""
+    names = set()
+    for file_name in os.listdir(course_dir):
+        if is_segment_file(file_name):
+            names.add(segment_name(file_name))
+    return sorted(names)
+
+
+def segment_content_keys(course_dir: str) -> Set[str]:
+    """Content keys referenced by any segment file in a course directory, published, retired or being written"""
+    keys = set()
+    # Content-addressed segments have no vector file, so their ids sidecars are read directly
+    for file_name in os.listdir(course_dir):
+        if not file_name.endswith(IDS_SUFFIX):
+            continue
+        try:
+            with open(os.path.join(course_dir, file_name), 'r') as f:
+                row_ids = json.load(f)
+        except FileNotFoundError:
+            continue
+        if isinstance(row_ids, dict):
+            keys.update(row_ids.get("content_keys") or ())
+    return keys
+
+
+def write_segment(course_dir: str, name: str, vectors: List[Dict[str, Any]],
+                  document_ids: Optional[List[str]] = None) -> str:
+    """Write vectors as a binary segment and return the path of the file that publishes it.
+
+    When every vector carries a "content_key", the embeddings are expected to
+    be in the content store and only the keys are written.
+    """
+    if document_ids is None:
+        document_ids = [name] * len(vectors)
+    payloads = [v["payload"] for v in vectors]
+    content_keys = None
+    if vectors and all("content_key" in v for v in vectors):
+        content_keys = [v["content_key"] for v in vectors]
+
+    # Write the sidecars first: readers discover segments through the .npy file,
+    # or through the ids sidecar of content-addressed segments
+    offsets = _write_payloads(
+        os.path.join(course_dir, f"{name}{PAYLOADS_SUFFIX}"),
+        payloads
+    )
+    atomic_write_npy(os.path.join(course_dir, f"{name}{PAYLOAD_INDEX_SUFFIX}"), offsets)
+    row_ids = {
+        "ids": [v["id"] for v in vectors],
+        "document_ids": document_ids,
+        "attributes": payload_attributes(payloads)
+    }
+    ids_path = os.path.join(course_dir, f"{name}{IDS_SUFFIX}")
+    if content_keys is not None:
+        row_ids["content_keys"] = content_keys
+        atomic_write_json(ids_path, row_ids)
+        published_path = ids_path
+    else:
+        atomic_write_json(ids_path, row_ids)
+        published_path = os.path.join(course_dir, f"{name}{VECTORS_SUFFIX}")
+        atomic_write_npy(published_path, _to_matrix(vectors))
+
+    # The new segment supersedes a legacy JSON file of the same document
+    legacy_path = os.path.join(course_dir, f"{name}{LEGACY_SUFFIX}")
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+    return published_path
+
+
+def _load_legacy_segment(course_dir: str, name: str) -> Segment:
+    """Load a document stored as a JSON list of {id, vector, payload} dicts"""
+    with open(os.path.join(course_dir, f"{name}{LEGACY_SUFFIX}"), 'r') as f:
+        vectors = json.load(f)
+
+    matrix = _to_matrix(vectors)
+    return Segment(
+        name,
+        [v["id"] for v in vectors],
+        matrix,
+        InlinePayloads([v["payload"] for v in vectors])
+    )
+
+
+def _load_vectors(vectors_path: str) -> np.ndarray:
+    try:
+        return np.load(vectors_path, mmap_mode='r')
+    except ValueError:
+        # Empty arrays cannot be memory-mapped
+        return np.load(vectors_path)
+
+
+def load_segment(course_dir: str, name: str) -> Optional[Segment]:
+    """Load a segment's ids and memory-mapped vectors, falling back to older layouts"""
+    vectors_path = os.path.join(course_dir, f"{name}{VECTORS_SUFFIX}")
+    ids_path = os.path.join(course_dir, f"{name}{IDS_SUFFIX}")
+    if os.path.exists(ids_path):
+        with open(ids_path, 'r') as f:
+            row_ids = json.load(f)
+        # Per-document segments stored a bare list of ids
+        if isinstance(row_ids, list):
+            row_ids = {"ids": row_ids, "document_ids": None}
+
+        content_keys = row_ids.get("content_keys")
+        if content_keys is not None:
+            # Imported here: the content store itself builds on this module's writers
+            from .content_store import content_store_for
+            vectors = content_store_for(os.path.dirname(course_dir)).view(content_keys)
+        elif os.path.exists(vectors_path):
+            vectors = _load_vectors(vectors_path)
+        else:
+            # The vector file is written last; without it the segment is not published yet
+            vectors = None
+
+        if vectors is not None:
+            payloads = PayloadFile(
+                os.path.join(course_dir, f"{name}{PAYLOADS_SUFFIX}"),
+                np.load(os.path.join(course_dir, f"{name}{PAYLOAD_INDEX_SUFFIX}"))
+            )
+            return Segment(
+                name, row_ids["ids"], vectors, payloads,
+                row_ids["document_ids"], row_ids.get("attributes"), content_keys
+            )
+
+    if os.path.exists(os.path.join(course_dir, f"{name}{LEGACY_SUFFIX}")):
+        return _load_legacy_segment(course_dir, name)
+
+    return None
+
+
+def delete_segment(course_dir: str, name: str) -> bool:
+    """Delete every file belonging to a segment"""
+    deleted = False
+    for suffix in SEGMENT_SUFFIXES:
+        path = os.path.join(course_dir, f"{name}{suffix}")
+        if os.path.exists(path):
+            os.remove(path)
+            deleted = True
+    return deleted
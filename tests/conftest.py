@@ -0,0 +1,17 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.file_vector_store import FileVectorStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """A file vector store in a temporary directory, without worker processes or background compaction"""
+    monkeypatch.setenv("VECTOR_SHARD_WORKERS", "0")
+    monkeypatch.setenv("VECTOR_COMPACTION_INTERVAL", "0")
+    vector_store = FileVectorStore(str(tmp_path))
+    yield vector_store
+    vector_store.shutdown_io_pool()
@@ -0,0 +1,199 @@
+import time
+import asyncio
+import numpy as np
+
+from services.vector_cache import CourseMatrix
+
+DIMENSION = 8
+QUERY = [1.0] * DIMENSION
+
+
+def make_vectors(document_id: str, count: int, seed: int):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            "id": f"{document_id}_{i}",
+            "vector": rng.random(DIMENSION).tolist(),
+            "payload": {"document_id": document_id, "content": f"{document_id} chunk {i}"}
+        }
+        for i in range(count)
+    ]
+
+
+async def search_documents(store, course_id: str):
+    results = await store.search_similar(QUERY, course_id, limit=50, score_threshold=-1.0)
+    return sorted({result["payload"]["document_id"] for result in results})
+
+
+def slow_down(monkeypatch, target, name: str, seconds: float):
+    """Make a method block its thread for `seconds` before running"""
+    original = getattr(target, name)
+
+    def slow(*args, **kwargs):
+        time.sleep(seconds)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(target, name, slow)
+
+
+def test_event_loop_keeps_running_during_slow_searches(store, monkeypatch):
+    async def scenario():
+        await store.store_vectors(make_vectors("a", 20, 1), "slow", "a")
+        await store.store_vectors(make_vectors("b", 20, 2), "fast", "b")
+        await search_documents(store, "fast")
+        store.cache.invalidate("slow")
+
+        # Loading the cold course blocks its I/O thread for half a second
+        slow_down(monkeypatch, CourseMatrix, "from_segments", 0.5)
+        slow_searches = [asyncio.create_task(search_documents(store, "slow")) for _ in range(3)]
+
+        gaps = []
+
+        async def heartbeat():
+            last = time.monotonic()
+            while not all(task.done() for task in slow_searches):
+                await asyncio.sleep(0.005)
+                now = time.monotonic()
+                gaps.append(now - last)
+                last = now
+
+        beating = asyncio.create_task(heartbeat())
+        await asyncio.sleep(0.05)
+
+        # Another chat request, on a course that is already resident, is answered meanwhile
+        started = time.monotonic()
+        fast_documents = await search_documents(store, "fast")
+        fast_elapsed = time.monotonic() - started
+        slow_still_running = not any(task.done() for task in slow_searches)
+
+        slow_documents = await asyncio.gather(*slow_searches)
+        await beating
+        return gaps, fast_documents, fast_elapsed, slow_still_running, slow_documents
+
+    gaps, fast_documents, fast_elapsed, slow_still_running, slow_documents = asyncio.run(scenario())
+    assert fast_documents == ["b"]
+    assert slow_still_running and fast_elapsed < 0.25
+    assert slow_documents == [["a"], ["a"], ["a"]]
+    assert gaps and max(gaps) < 0.1
+
+
+def test_store_during_cold_load_is_not_lost(store, monkeypatch):
+    async def scenario():
+        await store.store_vectors(make_vectors("a", 5, 1), "course", "a")
+        store.cache.invalidate("course")
+
+        slow_down(monkeypatch, CourseMatrix, "from_segments", 0.3)
+        cold_search = asyncio.create_task(search_documents(store, "course"))
+        await asyncio.sleep(0.1)
+        await store.store_vectors(make_vectors("b", 5, 2), "course", "b")
+        await cold_search
+        monkeypatch.undo()
+
+        return await search_documents(store, "course")
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+
+
+def test_delete_during_cold_load_stays_deleted(store, monkeypatch):
+    async def scenario():
+        await store.store_vectors(make_vectors("a", 5, 1), "course", "a")
+        await store.store_vectors(make_vectors("b", 5, 2), "course", "b")
+        store.cache.invalidate("course")
+
+        slow_down(monkeypatch, CourseMatrix, "from_segments", 0.3)
+        cold_search = asyncio.create_task(search_documents(store, "course"))
+        await asyncio.sleep(0.1)
+        assert await store.delete_document("b", "course")
+        await cold_search
+        monkeypatch.undo()
+
+        return await search_documents(store, "course")
+
+    assert asyncio.run(scenario()) == ["a"]
+
+
+def test_cold_load_during_compaction_survives_purge(store, monkeypatch):
+    async def scenario():
+        for i, document_id in enumerate("abcd"):
+            await store.store_vectors(make_vectors(document_id, 5, i), "course", document_id)
+        store.cache.invalidate("course")
+
+        # The search reads the manifest before compaction publishes, and caches after
+        slow_down(monkeypatch, CourseMatrix, "from_segments", 0.3)
+        cold_search = asyncio.create_task(search_documents(store, "course"))
+        await asyncio.sleep(0.1)
+        assert await store.run_io(store.compact_course, "course")
+        await cold_search
+        monkeypatch.undo()
+
+        # The next pass purges the retired segments the cold load was built from
+        store.compaction_grace = 0
+        await store.run_io(store.compact_course, "course")
+        return await search_documents(store, "course")
+
+    assert asyncio.run(scenario()) == ["a", "b", "c", "d"]
+
+
+def test_storing_into_a_small_course_does_not_load_it(store):
+    async def scenario():
+        await store.store_vectors(make_vectors("a", 5, 1), "course", "a")
+        store.cache.invalidate("course")
+        await store.store_vectors(make_vectors("b", 5, 2), "course", "b")
+        return store.cache.peek("course")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_ann_index_is_trained_once_the_course_reaches_the_threshold(store):
+    store.ann_threshold = 8
+
+    async def scenario():
+        await store.store_vectors(make_vectors("a", 5, 1), "course", "a")
+        trained_early = store._get_ann_index("course") is not None
+        await store.store_vectors(make_vectors("b", 5, 2), "course", "b")
+        return trained_early, store._get_ann_index("course")
+
+    trained_early, index = asyncio.run(scenario())
+    assert not trained_early
+    assert index is not None and len(index) == 10
+
+
+def test_reading_an_unknown_course_creates_nothing(store, tmp_path):
+    async def scenario():
+        results = await store.search_similar(QUERY, "missing", limit=5)
+        deleted = await store.delete_document("a", "missing")
+        return results, deleted, store.get_course_stats("missing")
+
+    results, deleted, stats = asyncio.run(scenario())
+    assert results == [] and not deleted and stats is None
+    assert not (tmp_path / "missing").exists()
+    assert "missing" not in store.course_ids()
+
+
+def test_deleting_a_course_shrinks_the_content_store(store, tmp_path):
+    store.compaction_grace = 0
+    content_dir = tmp_path / ".content"
+
+    def content_bytes():
+        return sum(path.stat().st_size for path in content_dir.iterdir())
+
+    def keyed(vectors):
+        for vector in vectors:
+            vector["content_key"] = f"key-{vector['id']}"
+        return vectors
+
+    async def scenario():
+        await store.store_vectors(keyed(make_vectors("a", 20, 1)), "kept", "a")
+        await store.store_vectors(keyed(make_vectors("b", 20, 2)), "gone", "b")
+        before = content_bytes()
+        assert await store.delete_course("gone")
+
+        # The first pass replaces the packs, the next one deletes the retired ones
+        await store.run_io(store.compact_all)
+        await store.run_io(store.compact_all)
+        return before, await search_documents(store, "kept")
+
+    before, documents = asyncio.run(scenario())
+    assert content_bytes() < before
+    assert len(store.content_store) == 20
+    assert documents == ["a"]
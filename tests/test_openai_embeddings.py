@@ -0,0 +1,110 @@
+import json
+import time
+import asyncio
+import httpx
+import pytest
+from openai import AsyncOpenAI, BadRequestError
+
+from services.openai_embeddings import OpenAIEmbeddingBatcher, plan_batches
+
+
+def embedding_response(texts):
+    # Items come back in reverse; callers must order them by index
+    data = [{"object": "embedding", "index": i, "embedding": [float(len(text)), 1.0]} for i, text in enumerate(texts)]
+    return httpx.Response(200, json={
+        "object": "list",
+        "data": data[::-1],
+        "model": "fake",
+        "usage": {"prompt_tokens": len(texts), "total_tokens": len(texts)}
+    })
+
+
+def fake_client(handler) -> AsyncOpenAI:
+    """OpenAI client talking to an in-process fake embeddings server"""
+    return AsyncOpenAI(
+        api_key="test",
+        base_url="http://fake-openai.test/v1",
+        max_retries=0,
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+
+
+def request_texts(request: httpx.Request):
+    return json.loads(request.content)["input"]
+
+
+def test_plan_batches_respects_token_and_input_limits():
+    texts = ["x" * 30] * 10
+    batches = plan_batches(texts, max_tokens=35, max_inputs=4)
+    assert [len(batch) for batch in batches] == [3, 3, 3, 1]
+    assert [i for batch in batches for i in batch] == list(range(10))
+
+
+def test_throttled_batch_waits_for_retry_after_ms():
+    calls = []
+
+    async def handler(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"retry-after-ms": "300"}, json={"error": {"message": "slow down"}})
+        return embedding_response(request_texts(request))
+
+    async def scenario():
+        batcher = OpenAIEmbeddingBatcher(fake_client(handler), "fake", base_delay=0.001, max_delay=0.001)
+        return await batcher.embed(["hello", "world!"]), batcher
+
+    embeddings, batcher = asyncio.run(scenario())
+    assert [e[0] for e in embeddings] == [5.0, 6.0]
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.3
+    assert batcher.stats() == {"requests": 2, "retries": 1}
+
+
+def test_concurrent_batches_keep_input_order():
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        texts = request_texts(request)
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # Later batches finish first
+        await asyncio.sleep(0.05 / len(texts[0]))
+        in_flight -= 1
+        return embedding_response(texts)
+
+    texts = ["x" * (i + 1) for i in range(40)]
+
+    async def scenario():
+        batcher = OpenAIEmbeddingBatcher(fake_client(handler), "fake", max_inputs=4, max_concurrency=3)
+        return await batcher.embed(texts)
+
+    embeddings = asyncio.run(scenario())
+    assert [e[0] for e in embeddings] == [float(len(text)) for text in texts]
+    assert peak == 3
+
+
+def test_failed_batch_cancels_its_siblings():
+    cancelled = []
+
+    async def handler(request):
+        texts = request_texts(request)
+        if texts[0] == "bad":
+            return httpx.Response(400, json={"error": {"message": "invalid input"}})
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(texts[0])
+            raise
+        return embedding_response(texts)
+
+    async def scenario():
+        batcher = OpenAIEmbeddingBatcher(fake_client(handler), "fake", max_inputs=1, max_concurrency=4)
+        started = time.monotonic()
+        with pytest.raises(BadRequestError):
+            await batcher.embed(["a", "b", "bad", "c"])
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+    assert elapsed < 1.0
+    assert sorted(cancelled) == ["a", "b", "c"]
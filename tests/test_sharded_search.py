@@ -0,0 +1,45 @@
+import os
+import numpy as np
+
+from services import sharded_search
+from services.sharded_search import score_shard
+
+
+def write_vectors(path: str, seed: int) -> np.ndarray:
+    vectors = np.random.default_rng(seed).random((50, 8)).astype(np.float32)
+    np.save(path, vectors)
+    return vectors
+
+
+def exact_top(vectors: np.ndarray, query: np.ndarray, limit: int):
+    scores = (vectors @ query) / np.linalg.norm(vectors, axis=1)
+    return np.argsort(-scores, kind='stable')[:limit]
+
+
+def test_reused_segment_path_is_not_served_from_stale_cache(tmp_path):
+    # A course deleted and uploaded again writes new files under the same segment names
+    path = str(tmp_path / "seg-00000001.npy")
+    query = np.ones(8, dtype=np.float32) / np.sqrt(8)
+    write_vectors(path, 1)
+    score_shard([(path, 0, 50, None)], query, 5)
+
+    os.remove(path)
+    vectors = write_vectors(path, 2)
+    positions, _ = score_shard([(path, 0, 50, None)], query, 5)
+
+    assert list(positions) == list(exact_top(vectors, query, 5))
+
+
+def test_maps_of_deleted_files_are_released(tmp_path):
+    query = np.ones(8, dtype=np.float32)
+    old_path = str(tmp_path / "seg-00000001.npy")
+    write_vectors(old_path, 1)
+    score_shard([(old_path, 0, 50, None)], query, 5)
+    os.remove(old_path)
+
+    new_path = str(tmp_path / "seg-00000002.npy")
+    write_vectors(new_path, 2)
+    score_shard([(new_path, 0, 50, None)], query, 5)
+
+    assert old_path not in sharded_search._vectors
+    assert all(key[0] != old_path for key in sharded_search._inverse_norms)
@@ -0,0 +1,12 @@
+import numpy as np
+
+from services.vector_filters import FilterIndex
+
+
+def test_repeated_filter_values_match_each_row_once():
+    document_ids = np.array(["a", "b", "a", "c", "a"], dtype=object)
+    chunk_types = np.array(["semantic", "semantic", "table", "semantic", None], dtype=object)
+    index = FilterIndex({"document_id": document_ids, "chunk_type": chunk_types})
+
+    assert list(index.rows({"document_id": ["a", "a"]})) == [0, 2, 4]
+    assert list(index.rows({"document_id": ["a", "a"], "chunk_type": ["semantic", "semantic"]})) == [0]